@@ -308,8 +308,6 @@ def operationValid(self, context):
             o.warnings = invalidmsg
 
         o.use_exact = False
-    o.update_offsetimage_tag = True
-    o.update_zbufferimage_tag = True
     print('validity ')
 
 
@@ -344,20 +342,18 @@ def updateChipload(self, context):
 
 
 def updateOffsetImage(self, context):
-    """refresh offset image tag for rerendering"""
+    """marks the operation changed, the offset image is checked against its cache key on calculation time"""
     updateChipload(self, context)
     print('update offset')
     self.changed = True
-    self.update_offsetimage_tag = True
 
 
 def updateZbufferImage(self, context):
-    """changes tags so offset and zbuffer images get updated on calculation time."""
+    """marks the operation changed, the zbuffer and offset images are checked against their cache keys
+    on calculation time"""
     # print('updatezbuf')
     # print(self,context)
     self.changed = True
-    self.update_zbufferimage_tag = True
-    self.update_offsetimage_tag = True
     utils.getOperationSources(self)
 
 
@@ -380,8 +376,6 @@ def updateCutout(o, context):
 def updateExact(o, context):
     print('update exact ')
     o.changed = True
-    o.update_zbufferimage_tag = True
-    o.update_offsetimage_tag = True
     if o.use_exact and (
              o.strategy == 'POCKET' or o.strategy == 'MEDIAL_AXIS' or o.inverse):
         #    o.use_exact = False
@@ -477,6 +471,15 @@ class camOperation(bpy.types.PropertyGroup):
         default=False)
     simplify_tol: bpy.props.IntProperty(name="Tolerance", description='lower number means more precise', default=50,
                                         min=1, max=1000)
+    use_arc_fitting: bpy.props.BoolProperty(
+        name="Fit arcs",
+        description="Replace runs of points lying on circular arcs"
+                    " with G2/G3 moves, helical where the post-processor supports it",
+        default=False)
+    arc_tolerance: bpy.props.FloatProperty(name="Arc tolerance",
+                                           description="maximal deviation of arcs from the original path",
+                                           default=0.00001, min=0.0000001, max=0.01, precision=PRECISION,
+                                           unit="LENGTH")
     hide_all_others: bpy.props.BoolProperty(
         name="Hide all others",
         description="Hide all other tool pathes except toolpath"
@@ -872,6 +875,10 @@ class camOperation(bpy.types.PropertyGroup):
     use_opencamlib: bpy.props.BoolProperty(name="Use OpenCAMLib",
                                            description="Use OpenCAMLib to sample paths or get waterline shape",
                                            default=False, update=updateOpencamlib)
+    waterline_sampling: bpy.props.FloatProperty(name="Waterline sampling",
+                                                 description="Sampling distance of OpenCAMLib waterline",
+                                                 default=0.0001, min=0.000001, max=0.01, precision=PRECISION,
+                                                 unit="LENGTH", update=updateRest)
     pixsize: bpy.props.FloatProperty(name="sampling raster detail", default=0.0001, min=0.00001, max=0.1,
                                      precision=PRECISION, unit="LENGTH", update=updateZbufferImage)
     simulation_detail: bpy.props.FloatProperty(name="Simulation sampling raster detail", default=0.0002, min=0.00001,
@@ -1048,6 +1055,8 @@ class camOperation(bpy.types.PropertyGroup):
 
     silhouete = sgeometry.Polygon()
     ambient = sgeometry.Polygon()
+    ambient_mask = None
+    bullet_heights = None
     operation_limit = sgeometry.Polygon()
     borderwidth = 50
     object = None
@@ -0,0 +1,123 @@
+# fitting of circular arcs to toolpath points, for G2/G3 moves
+# this module doesn't import bpy, so the fitting can be checked outside of blender, see testing_arcs.py
+
+import math
+from math import pi
+import numpy
+
+
+def fitArc(co, tolerance, helical=True):
+    """fits a circular arc in the xy plane through points co, so that no point and no segment of the
+    polyline deviates from it more than tolerance.
+    returns (center x, center y, clockwise, length, sagitta of the whole arc) or None"""
+    x = co[:, 0]
+    y = co[:, 1]
+    z = co[:, 2]
+    m = len(co) // 2
+    # circle through the first, middle and last point
+    ax, ay = x[m] - x[0], y[m] - y[0]
+    bx, by = x[-1] - x[0], y[-1] - y[0]
+    d = 2 * (ax * by - ay * bx)
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    if abs(d) <= 1e-9 * math.sqrt(a2 * b2):
+        return None
+    cx = x[0] + (by * a2 - ay * b2) / d
+    cy = y[0] + (ax * b2 - bx * a2) / d
+    r = math.hypot(x[0] - cx, y[0] - cy)
+
+    if numpy.abs(numpy.hypot(x - cx, y - cy) - r).max() > tolerance:
+        return None
+    steps = numpy.diff(numpy.arctan2(y - cy, x - cx))
+    steps = (steps + pi) % (2 * pi) - pi
+    if (steps < 0).all():
+        cw = True
+    elif (steps > 0).all():
+        cw = False
+    else:
+        return None
+    steps = numpy.abs(steps)
+    sweep = steps.sum()
+    if sweep > 2 * pi - 0.01:
+        return None
+    # segments of the polyline are chords of the arc
+    if r * (1 - math.cos(steps.max() / 2)) > tolerance:
+        return None
+
+    dz = z[-1] - z[0]
+    if dz != 0 and not helical:
+        return None
+    zline = z[0] + dz * numpy.concatenate(([0], numpy.cumsum(steps))) / sweep
+    if numpy.abs(z - zline).max() > tolerance:
+        return None
+    return cx, cy, cw, math.hypot(r * sweep, dz), r * (1 - math.cos(min(sweep, pi) / 2))
+
+
+def getArcs(co, feedmove, tolerance, helical=True, min_points=4):
+    """finds runs of points which can be replaced by arcs.
+    feedmove tells which points are reached by a milling move, only these can become part of an arc.
+    returns a dict of arc end index: (arc start index, center x, center y, clockwise, length)"""
+    co = numpy.asarray(co, dtype=numpy.float64)
+    n = len(co)
+    arcs = {}
+    if n < min_points:
+        return arcs
+    # prefilter: the next point lies on the circle through the previous three
+    p0, p1, p2, p3 = co[:-3, :2], co[1:-2, :2], co[2:-1, :2], co[3:, :2]
+    a = p1 - p0
+    b = p2 - p0
+    d = 2 * (a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0])
+    a2 = (a * a).sum(axis=1)
+    b2 = (b * b).sum(axis=1)
+    c = p3 - p1
+    turn = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    nextturn = (p2 - p1)[:, 0] * c[:, 1] - (p2 - p1)[:, 1] * c[:, 0]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cx = p0[:, 0] + (b[:, 1] * a2 - a[:, 1] * b2) / d
+        cy = p0[:, 1] + (a[:, 0] * b2 - b[:, 0] * a2) / d
+        r = numpy.hypot(p0[:, 0] - cx, p0[:, 1] - cy)
+        candidate = numpy.abs(numpy.hypot(p3[:, 0] - cx, p3[:, 1] - cy) - r) <= tolerance
+    candidate &= (numpy.abs(d) > 1e-9 * numpy.sqrt(a2 * b2)) & (turn * nextturn > 0)
+    # all moves of the run have to be milling moves
+    notfeed = numpy.flatnonzero(~numpy.asarray(feedmove, dtype=bool))
+    starts = numpy.flatnonzero(candidate)
+
+    si = 0
+    while si < len(starts):
+        s = starts[si]
+        e = s + min_points - 1
+        # last index of the run of milling moves after s
+        nf = numpy.searchsorted(notfeed, s + 1)
+        emax = notfeed[nf] - 1 if nf < len(notfeed) else n - 1
+        fit = None
+        if e <= emax:
+            fit = fitArc(co[s:e + 1], tolerance, helical)
+        if fit is None:
+            si += 1
+            continue
+        good = e
+        bad = None
+        step = min_points
+        while good < emax:
+            e = min(good + step, emax)
+            efit = fitArc(co[s:e + 1], tolerance, helical)
+            if efit is None:
+                bad = e
+                break
+            good, fit = e, efit
+            step *= 2
+        if bad is not None:
+            while bad - good > 1:
+                e = (good + bad) // 2
+                efit = fitArc(co[s:e + 1], tolerance, helical)
+                if efit is None:
+                    bad = e
+                else:
+                    good, fit = e, efit
+        if fit[4] <= tolerance:
+            # flat enough to be a line
+            si += 1
+            continue
+        arcs[int(good)] = (int(s),) + fit[:4]
+        si = numpy.searchsorted(starts, good)
+    return arcs
@@ -26,6 +26,7 @@ from shapely import geometry as sgeometry
 from cam import polygon_utils_cam
 from cam.simple import *
 import math
+import numpy
 
 
 def Rotate_pbyp(originp, p, ang):  # rotate point around another point with angle
@@ -43,18 +44,178 @@ def Rotate_pbyp(originp, p, ang):  # rotate point around another point with angl
     return rot_p
 
 
+class ChunkPoints:
+    """points of a chunk in one contiguous (n,3) float array, which grows like a list.
+    behaves like the list of tuples the strategies build and edit, items are read as tuples"""
+    __slots__ = ('_a', '_n', '_shared')
+
+    def __init__(self, points=()):
+        self._shared = False
+        self.setArray(points)
+
+    def setArray(self, points):
+        a = numpy.array(points, dtype=float)
+        if len(a) == 0:
+            a = numpy.empty((0, 3))
+        self._a = a
+        self._n = len(a)
+        self._shared = False
+
+    def array(self):
+        """view of the points, valid until they change"""
+        return self._a[:self._n]
+
+    def writableArray(self):
+        """view of the points for changing them in place"""
+        self._write()
+        return self._a[:self._n]
+
+    def share(self):
+        """view of the points which stays unchanged, they are copied on the next change"""
+        self._shared = True
+        return self._a[:self._n]
+
+    def _write(self, grow=0):
+        """makes the array writable for the next change, with room for grow more points"""
+        n = self._n + grow
+        if n > len(self._a) or self._shared:
+            a = numpy.empty((max(n, 2 * len(self._a), 8), self._a.shape[1]))
+            a[:self._n] = self._a[:self._n]
+            self._a = a
+            self._shared = False
+
+    def _fit(self, p):
+        # the first point sets how many coordinates the points have
+        if self._n == 0 and self._a.shape[1] != len(p):
+            self._a = numpy.empty((len(self._a), len(p)))
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        return map(tuple, self._a[:self._n].tolist())
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(map(tuple, self._a[:self._n][i].tolist()))
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError('chunk point index out of range')
+        return tuple(self._a[i].tolist())
+
+    def __setitem__(self, i, p):
+        if isinstance(i, slice):
+            points = list(self)
+            points[i] = p
+            self.setArray(points)
+            return
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError('chunk point index out of range')
+        self._write()
+        self._a[i] = p
+
+    def __delitem__(self, i):
+        points = list(self)
+        del points[i]
+        self.setArray(points)
+
+    def __array__(self, dtype=None, copy=None):
+        return numpy.array(self._a[:self._n], dtype=dtype)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, p):
+        self._write(1)
+        self._fit(p)
+        self._a[self._n] = p
+        self._n += 1
+
+    def extend(self, points):
+        if isinstance(points, ChunkPoints):
+            points = points.array()
+        elif not isinstance(points, (numpy.ndarray, list, tuple)):
+            points = list(points)
+        points = numpy.array(points, dtype=float)
+        if len(points) == 0:
+            return
+        self._write(len(points))
+        self._fit(points[0])
+        self._a[self._n:self._n + len(points)] = points
+        self._n += len(points)
+
+    def insert(self, i, p):
+        if i < 0:
+            i = max(0, i + self._n)
+        i = min(i, self._n)
+        self._write(1)
+        self._fit(p)
+        self._a[i + 1:self._n + 1] = self._a[i:self._n].copy()
+        self._a[i] = p
+        self._n += 1
+
+    def pop(self, i=-1):
+        p = self[i]
+        if i < 0:
+            i += self._n
+        self._write()
+        self._a[i:self._n - 1] = self._a[i + 1:self._n].copy()
+        self._n -= 1
+        return p
+
+    def reverse(self):
+        self._write()
+        self._a[:self._n] = self._a[:self._n][::-1].copy()
+
+    def copy(self):
+        return ChunkPoints(self._a[:self._n])
+
+    def index(self, p):
+        return list(self).index(tuple(p))
+
+    def count(self, p):
+        return list(self).count(tuple(p))
+
+    def clear(self):
+        self._write()
+        self._n = 0
+
+
 class camPathChunk:
-    # parents=[]
-    # children=[]
-    # sorted=False
+    # points are stored in one array per chunk, strategies still edit them like a list of tuples.
+    __slots__ = ('_points', 'startpoints', 'endpoints', 'rotations', 'closed', 'children', 'parents', 'sorted',
+                 'length', 'zstart', 'zend', 'depth', 'cango', 'nparents', 'simppoly', 'simppoly_source',
+                 '_poly', '_polypoints')
 
     # progressIndex=-1# for e.g. parallel strategy, when trying to save time..
     def __init__(self, inpoints, startpoints=None, endpoints=None, rotations=None):
-        if len(inpoints) > 2:
-            self.poly = sgeometry.Polygon(inpoints)
-        else:
-            self.poly = sgeometry.Polygon()
         self.points = inpoints  # for 3 axes, this is only storage of points. For N axes, here go the sampled points
+        # polygon is built on first use, from the points the chunk was created with.
+        # they are shared with the chunk until it changes them.
+        self._poly = None
+        if len(self._points) > 2:
+            self._polypoints = self._points.share()
+        else:
+            self._polypoints = None
         if startpoints:
             self.startpoints = startpoints  # from where the sweep test begins, but also retract point for given path
         else:
@@ -77,6 +238,43 @@ class camPathChunk:
         # because they are added afterwards, but have to use layer info
         self.zend = 0  #
 
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        if isinstance(points, ChunkPoints):
+            self._points = points
+        else:
+            self._points = ChunkPoints(points)
+
+    @property
+    def poly(self):
+        if self._poly is None:
+            if self._polypoints is not None:
+                self._poly = sgeometry.Polygon(self._polypoints)
+            else:
+                self._poly = sgeometry.Polygon()
+            self._polypoints = None
+        return self._poly
+
+    @poly.setter
+    def poly(self, p):
+        self._poly = p
+        self._polypoints = None
+
+    def pointsArray(self):
+        """chunk points as (n,3) float array"""
+        a = numpy.array(self._points.array())
+        if len(a) == 0:
+            return a.reshape(0, 3)
+        return a
+
+    def setPointsArray(self, a):
+        """replaces the chunk points by (n,3) array, keeping the points object"""
+        self._points.setArray(a)
+
     def copy(self):
         nchunk = camPathChunk([])
         nchunk.points.extend(self.points)
@@ -91,51 +289,37 @@ class camPathChunk:
         return nchunk
 
     def shift(self, x, y, z):
-
-        for i, p in enumerate(self.points):
-            self.points[i] = (p[0] + x, p[1] + y, p[2] + z)
-        for i, p in enumerate(self.startpoints):
-            self.startpoints[i] = (p[0] + x, p[1] + y, p[2] + z)
-        for i, p in enumerate(self.endpoints):
-            self.endpoints[i] = (p[0] + x, p[1] + y, p[2] + z)
+        self._points.writableArray()[:] += (x, y, z)
+        self.startpoints[:] = [(p[0] + x, p[1] + y, p[2] + z) for p in self.startpoints]
+        self.endpoints[:] = [(p[0] + x, p[1] + y, p[2] + z) for p in self.endpoints]
 
     def setZ(self, z):
-        for i, p in enumerate(self.points):
-            self.points[i] = (p[0], p[1], z)
+        self._points.writableArray()[:, 2] = z
 
     def offsetZ(self, z):
-        for i, p in enumerate(self.points):
-            self.points[i] = (p[0], p[1], z + p[2])
+        self._points.writableArray()[:, 2] += z
 
     def isbelowZ(self, z):
-        isbelow = False
-        for p in self.points:
-            if p[2] <= z:
-                isbelow = True
-        return isbelow
+        return bool((self._points.array()[:, 2] <= z).any())
 
     def clampZ(self, z):
-        for i, p in enumerate(self.points):
-            if p[2] < z:
-                self.points[i] = (p[0], p[1], z)
+        a = self._points.writableArray()
+        a[:, 2] = numpy.maximum(a[:, 2], z)
 
     def clampmaxZ(self, z):
-        for i, p in enumerate(self.points):
-            if p[2] > z:
-                self.points[i] = (p[0], p[1], z)
+        a = self._points.writableArray()
+        a[:, 2] = numpy.minimum(a[:, 2], z)
+
+    def closestPointIndex(self, pos):
+        """index of the first point closest to pos in x,y"""
+        a = self.points.array()
+        return int(numpy.argmin(numpy.hypot(pos[0] - a[:, 0], pos[1] - a[:, 1])))
 
     def dist(self, pos, o):
         if self.closed:
-            mind = 10000000
-            minv = -1
-            for vi in range(0, len(self.points)):
-                v = self.points[vi]
-                # print(v,pos)
-                d = dist2d(pos, v)
-                if d < mind:
-                    mind = d
-                    minv = vi
-            return mind
+            if len(self.points) == 0:
+                return 10000000
+            return dist2d(pos, self.points[self.closestPointIndex(pos)])
         else:
             if o.movement_type == 'MEANDER':
                 d1 = dist2d(pos, self.points[0])
@@ -152,15 +336,9 @@ class camPathChunk:
     def adaptdist(self, pos, o):
         # reorders chunk so that it starts at the closest point to pos.
         if self.closed:
-            mind = 10000000
             minv = -1
-            for vi in range(0, len(self.points)):
-                v = self.points[vi]
-                # print(v,pos)
-                d = dist2d(pos, v)
-                if d < mind:
-                    mind = d
-                    minv = vi
+            if len(self.points) > 0:
+                minv = self.closestPointIndex(pos)
 
             newchunk = []
             newchunk.extend(self.points[minv:])
@@ -182,8 +360,7 @@ class camPathChunk:
         closest = None
         testlist = []
         testlist.extend(self.children)
-        tested = []
-        tested.extend(self.children)
+        tested = set(self.children)
         ch = None
         while len(testlist) > 0:
             chtest = testlist.pop()
@@ -195,7 +372,7 @@ class camPathChunk:
                     if not child.sorted:
                         if child not in tested:
                             testlist.append(child)
-                            tested.append(child)
+                            tested.add(child)
                         cango = False
 
                 if cango:
@@ -212,19 +389,11 @@ class camPathChunk:
     def getLength(self):
         # computes length of the chunk - in 3d
         self.length = 0
-
-        for vi, v1 in enumerate(self.points):
-            # print(len(self.points),vi)
-            v2 = Vector(v1)  # this is for case of last point and not closed chunk..
-            if self.closed and vi == len(self.points) - 1:
-                v2 = Vector(self.points[0])
-            elif vi < len(self.points) - 1:
-                v2 = Vector(self.points[vi + 1])
-            v1 = Vector(v1)
-            v = v2 - v1
-            self.length += v.length
-
-    # print(v,pos)
+        if len(self.points) > 1:
+            a = self.points.array()
+            if self.closed:
+                a = numpy.vstack((a, a[:1]))
+            self.length = float(numpy.sqrt((numpy.diff(a, axis=0) ** 2).sum(axis=1)).sum())
 
     def reverse(self):
         self.points.reverse()
@@ -661,14 +830,17 @@ def limitChunks(chunks, o,
                 force=False):  # TODO: this should at least add point on area border...
     # but shouldn't be needed at all at the first place...
     if o.use_limit_curve or force:
+        ambientmask = polygon_utils_cam.getAmbientMask(o)
         nchunks = []
         for ch in chunks:
             prevsampled = True
             nch = camPathChunk([])
             nch1 = nch
             closed = True
-            for s in ch.points:
-                sampled = o.ambient.contains(sgeometry.Point(s[0], s[1]))
+            chunkpoints = numpy.array(ch.points, dtype=float).reshape(-1, 3)
+            chunkinside = ambientmask.containsPoints(chunkpoints[:, 0], chunkpoints[:, 1])
+            for si, s in enumerate(ch.points):
+                sampled = chunkinside[si]
                 if not sampled and len(nch.points) > 0:
                     nch.closed = False
                     closed = False
@@ -705,6 +877,34 @@ def parentChildPoly(parents, children, o):
                     child.parents.append(parent)
 
 
+def getSimplifiedBoundary(ch):
+    """simplified chunk polygon boundary, kept with the chunk until its polygon changes"""
+    if getattr(ch, 'simppoly_source', None) is not ch.poly:
+        ch.simppoly = ch.poly.simplify(0.0003).boundary
+        ch.simppoly_source = ch.poly
+    return ch.simppoly
+
+
+def getChunkBox(ch, pts):
+    """bounding box of chunk points together with its polygon, the polygon can be older than the points"""
+    minx, miny = pts.min(axis=0)
+    maxx, maxy = pts.max(axis=0)
+    if not ch.poly.is_empty:
+        pminx, pminy, pmaxx, pmaxy = ch.poly.bounds
+        minx, miny, maxx, maxy = min(minx, pminx), min(miny, pminy), max(maxx, pmaxx), max(maxy, pmaxy)
+    return minx, miny, maxx, maxy
+
+
+def pointsCloser(pts1, pts2, dlim):
+    """True if any two points of the 2 point arrays are closer than dlim"""
+    for i in range(0, len(pts1), 256):
+        block = pts1[i:i + 256]
+        d = numpy.hypot(block[:, 0].reshape(-1, 1) - pts2[:, 0], block[:, 1].reshape(-1, 1) - pts2[:, 1])
+        if (d < dlim).any():
+            return True
+    return False
+
+
 def parentChildDist(parents, children, o, distance=None):
     # parenting based on x,y distance between chunks
     # hierarchy works like this: - children get milled first.
@@ -714,39 +914,43 @@ def parentChildDist(parents, children, o, distance=None):
             dlim = dlim * 2
     else:
         dlim = distance
-    # print('distance')
-    # print(len(children),len(parents))
-    # i=0
     # simplification greatly speeds up the distance finding algorithms.
-    for child in children:
-        if not child.poly.is_empty:
-            child.simppoly = child.poly.simplify(0.0003).boundary
-    for parent in parents:
-        if not parent.poly.is_empty:
-            parent.simppoly = parent.poly.simplify(0.0003).boundary
+    # only pairs with bounding boxes closer than dlim, found in a STRtree, get the exact distance test.
+    parents = [parent for parent in parents if len(parent.points) > 0]
+    if len(parents) == 0:
+        return
+    parentpoints = [numpy.array(parent.points, dtype=float)[:, :2] for parent in parents]
+    everywhere = []  # degenerate simplified polygons, their distance isn't bound by their box
+    boxes = []
+    for pi, parent in enumerate(parents):
+        boxes.append(getChunkBox(parent, parentpoints[pi]))
+        if not parent.poly.is_empty and getSimplifiedBoundary(parent).is_empty:
+            everywhere.append(pi)
+    query = polygon_utils_cam.getBoxTree(boxes)
 
     for child in children:
-        for parent in parents:
-            # print(len(children),len(parents))
+        if len(child.points) == 0:
+            continue
+        childpoints = numpy.array(child.points, dtype=float)[:, :2]
+        if not child.poly.is_empty and getSimplifiedBoundary(child).is_empty:
+            candidates = range(len(parents))
+        else:
+            minx, miny, maxx, maxy = getChunkBox(child, childpoints)
+            candidates = query((minx - dlim, miny - dlim, maxx + dlim, maxy + dlim))
+            if len(everywhere) > 0:
+                candidates = sorted(set(candidates).union(everywhere))
+        for pi in candidates:
+            parent = parents[pi]
             isrelation = False
             if parent != child:
                 if not parent.poly.is_empty and not child.poly.is_empty:
-                    # print(dir(parent.simppoly))
                     d = parent.simppoly.distance(child.simppoly)
                     if d < dlim:
                         isrelation = True
                 else:  # this is the old method, preferably should be replaced in most cases except parallell
                     # where this method works probably faster.
-                    # print('warning, sorting will be slow due to bad parenting in parentChildDist')
-                    for v in child.points:
-                        for v1 in parent.points:
-                            if dist2d(v, v1) < dlim:
-                                isrelation = True
-                                break
-                        if isrelation:
-                            break
+                    isrelation = pointsCloser(childpoints, parentpoints[pi], dlim)
                 if isrelation:
-                    # print('truelink',dist2d(v,v1))
                     parent.children.append(child)
                     child.parents.append(parent)
 
@@ -770,13 +974,19 @@ def chunksToShapely(chunks):  # this does more cleve chunks to Poly with hierarc
             # pchunk=[]
             ch.poly = sgeometry.Polygon(ch.points)
 
-    for ppart in chunks:  # then add hierarchy relations
-        for ptest in chunks:
-
-            if ppart != ptest:
-                if ptest.poly.contains(ppart.poly):
-                    # hierarchy works like this: - children get milled first.
-                    ppart.parents.append(ptest)
+    # then add hierarchy relations, only polygons with bounding boxes around each other can contain each other.
+    polychunks = [ch for ch in chunks if not ch.poly.is_empty]
+    if len(polychunks) > 0:
+        query = polygon_utils_cam.getBoxTree([ch.poly.bounds for ch in polychunks])
+        for ppart in polychunks:
+            minx, miny, maxx, maxy = ppart.poly.bounds
+            for ti in query(ppart.poly.bounds):
+                ptest = polychunks[ti]
+                tminx, tminy, tmaxx, tmaxy = ptest.poly.bounds
+                if ppart != ptest and tminx <= minx and tminy <= miny and tmaxx >= maxx and tmaxy >= maxy:
+                    if ptest.poly.contains(ppart.poly):
+                        # hierarchy works like this: - children get milled first.
+                        ppart.parents.append(ptest)
 
     for ch in chunks:  # now make only simple polygons with holes, not more polys inside others
         # print(len(chunks[polyi].parents))
@@ -1023,29 +1233,24 @@ def shapelyToChunks(p, zlevel):  #
     chunks = []
     # p=sortContours(p)
     seq = polygon_utils_cam.shapelyToCoords(p)
-    i = 0
     for s in seq:
-        # progress(p[i])
         if len(s) > 1:
             chunk = camPathChunk([])
-            if len(s) == 2:
-                sgeometry.LineString(s)
-            else:
+            co = numpy.asarray(s, dtype=float)
+            if len(s) > 2:
                 chunk.poly = spolygon.Polygon(
-                    s)  # this should maybe be LineString? but for sorting, we need polygon inside functions.
-            for v in s:
-                # progress (v)
-                # print(v)
-                if p.has_z:
-                    chunk.points.append((v[0], v[1], v[2]))
-                else:
-                    chunk.points.append((v[0], v[1], zlevel))
+                    co)  # this should maybe be LineString? but for sorting, we need polygon inside functions.
+            points = numpy.empty((len(co), 3))
+            if p.has_z:
+                points[:] = co[:, :3]
+            else:
+                points[:, :2] = co[:, :2]
+                points[:, 2] = zlevel
+            chunk.setPointsArray(points)
 
-            # chunk.points.append((chunk.points[0][0],chunk.points[0][1],chunk.points[0][2]))#last point =first point
             if chunk.points[0] == chunk.points[-1] and len(s) > 2:
                 chunk.closed = True
             chunks.append(chunk)
-        i += 1
     chunks.reverse()  # this is for smaller shapes first.
     #
     return chunks
@@ -21,6 +21,8 @@
 
 import bpy
 import time
+import math
+import numpy
 
 from cam import simple
 from cam.simple import *
@@ -282,6 +284,7 @@ def prepareBulletCollision(o):
     bpy.context.scene.frame_set(0)
     bpy.context.scene.frame_set(1)
     bpy.context.scene.frame_set(2)
+    o.bullet_heights = getBulletHeightGrid(o)
     progress(time.time() - t)
 
 
@@ -319,6 +322,92 @@ def getSampleBullet(cutter, x, y, radius, startz, endz):
         return endz - 10
 
 
+BULLET_GRID_MAX_CELLS = 4000000
+
+
+def getCollisionBoxes(ob):
+    """boxes (minx, maxx, miny, maxy, maxz) in world space enclosing everything the rigid body can collide with"""
+    m = ob.rigid_body.collision_margin
+    if ob.type == 'MESH' and ob.rigid_body.collision_shape == 'MESH' and len(ob.modifiers) == 0:
+        mesh = ob.data
+        mesh.calc_loop_triangles()
+        co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get('co', co)
+        tris = numpy.empty(len(mesh.loop_triangles) * 3, dtype=numpy.int32)
+        mesh.loop_triangles.foreach_get('vertices', tris)
+        mat = numpy.array(ob.matrix_world, dtype=numpy.float64)
+        co = co.reshape(-1, 3) @ mat[:3, :3].T + mat[:3, 3]
+        tris = co[tris.reshape(-1, 3)]
+        mins = tris.min(axis=1)
+        maxs = tris.max(axis=1)
+    else:
+        corners = numpy.array([ob.matrix_world @ Vector(c) for c in ob.bound_box])
+        mins = corners.min(axis=0).reshape(1, 3)
+        maxs = corners.max(axis=0).reshape(1, 3)
+    return numpy.column_stack((mins[:, 0] - m, maxs[:, 0] + m, mins[:, 1] - m, maxs[:, 1] + m, maxs[:, 2] + m))
+
+
+def getBulletHeightGrid(o):
+    """coarse upper bound of the collision world surface, used to start bullet sweeps just above it.
+    returns (heights, minx, miny, cellsize) in bullet units. heights are the maximal height
+    the cutter can touch anywhere above the cell"""
+    cutter = o.cutter_shape
+    cutter_margin = cutter.rigid_body.collision_margin
+    radius = max(cutter.dimensions.x, cutter.dimensions.y) / 2 + cutter_margin
+    minx = o.min.x * BULLET_SCALE - 2 * radius
+    miny = o.min.y * BULLET_SCALE - 2 * radius
+    sx = (o.max.x - o.min.x) * BULLET_SCALE + 4 * radius
+    sy = (o.max.y - o.min.y) * BULLET_SCALE + 4 * radius
+    # cells are at least the cutter radius, so the cutter above a cell reaches only the neighbour cells
+    cellsize = max(radius, math.sqrt(sx * sy / BULLET_GRID_MAX_CELLS))
+    nx = int(sx / cellsize) + 1
+    ny = int(sy / cellsize) + 1
+    heights = numpy.full((nx, ny), -numpy.inf)
+
+    for ob in bpy.context.scene.objects:
+        if ob.rigid_body is None or ob == cutter:
+            continue
+        boxes = getCollisionBoxes(ob)
+        ix0 = numpy.floor((boxes[:, 0] - minx) / cellsize).astype(int)
+        ix1 = numpy.floor((boxes[:, 1] - minx) / cellsize).astype(int)
+        iy0 = numpy.floor((boxes[:, 2] - miny) / cellsize).astype(int)
+        iy1 = numpy.floor((boxes[:, 3] - miny) / cellsize).astype(int)
+        inside = (ix1 >= 0) & (ix0 < nx) & (iy1 >= 0) & (iy0 < ny)
+        ix0 = numpy.clip(ix0[inside], 0, nx - 1)
+        ix1 = numpy.clip(ix1[inside], 0, nx - 1)
+        iy0 = numpy.clip(iy0[inside], 0, ny - 1)
+        iy1 = numpy.clip(iy1[inside], 0, ny - 1)
+        z = (boxes[inside, 4] + cutter_margin)
+        small = (ix1 - ix0 < 4) & (iy1 - iy0 < 4)
+        for dx in range(4):
+            for dy in range(4):
+                sel = small & (ix0 + dx <= ix1) & (iy0 + dy <= iy1)
+                numpy.maximum.at(heights, (ix0[sel] + dx, iy0[sel] + dy), z[sel])
+        for i in numpy.flatnonzero(~small):
+            cells = heights[ix0[i]:ix1[i] + 1, iy0[i]:iy1[i] + 1]
+            numpy.maximum(cells, z[i], out=cells)
+
+    # what the cutter above a cell can touch
+    padded = numpy.pad(heights, 1, constant_values=-numpy.inf)
+    footprint = heights.copy()
+    for dx in range(3):
+        for dy in range(3):
+            numpy.maximum(footprint, padded[dx:dx + nx, dy:dy + ny], out=footprint)
+    return footprint, minx, miny, cellsize
+
+
+def getBulletHeightBounds(o, points):
+    """upper bound of the cutter tip height where it touches the collision world, for each of points.
+    points outside of the grid get inf"""
+    heights, minx, miny, cellsize = o.bullet_heights
+    ix = numpy.floor((points[:, 0] * BULLET_SCALE - minx) / cellsize).astype(int)
+    iy = numpy.floor((points[:, 1] * BULLET_SCALE - miny) / cellsize).astype(int)
+    inside = (ix >= 0) & (ix < heights.shape[0]) & (iy >= 0) & (iy < heights.shape[1])
+    bounds = numpy.full(len(points), numpy.inf)
+    bounds[inside] = heights[ix[inside], iy[inside]] / BULLET_SCALE
+    return bounds
+
+
 def getSampleBulletNAxis(cutter, startpoint, endpoint, rotation, cutter_compensation):
     """fully 3d collision test for NAxis milling"""
     cutterVec = Vector((0, 0, 1)) * cutter_compensation
@@ -23,6 +23,7 @@
 
 import bpy
 import time
+import json
 import mathutils
 import math
 from math import *
@@ -55,7 +56,9 @@ from cam.polygon_utils_cam import *
 from cam import image_utils
 from cam.image_utils import *
 from cam.opencamlib.opencamlib import *
+from cam.arcs import getArcs
 from cam.nc import iso
+from cam.nc import nc
 
 
 def pointonline(a, b, c, tolerence):
@@ -70,6 +73,67 @@ def pointonline(a, b, c, tolerence):
         return True
 
 
+def pointsOnLine(co, tolerence):
+    """vectorized pointonline, tests co[js] against the line from co[first] through co[js - 1]"""
+    def online(first, js):
+        b = (co[js - 1] - co[first]).astype(numpy.float64)
+        c = (co[js] - co[first]).astype(numpy.float64)
+        dot_pr = (b * c).sum(axis=1)
+        norms = numpy.sqrt((b * b).sum(axis=1)) * numpy.sqrt((c * c).sum(axis=1))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            angle = numpy.rad2deg(numpy.arccos(dot_pr / norms))
+        return ~(angle > tolerence)  # nan counts as on line, same as in pointonline
+
+    return online
+
+
+def getRedundantPoints(co, tolerence):
+    """returns a mask of vertices which survive redundant point removal, and the number of line breaks.
+    gives the same result as the sequential pointonline test in exportGcodePath used to"""
+    n = len(co)
+    keep = numpy.ones(n, dtype=bool)
+    offline = 0
+    if n < 3:
+        return keep, offline
+    online = pointsOnLine(co, tolerence)
+    # right after a new start point, the line is defined by the two preceding points
+    js = numpy.arange(2, n)
+    online_next = numpy.zeros(n, dtype=bool)
+    online_next[2:] = online(js - 2, js)
+
+    first = 0
+    j = 2
+    while j < n:
+        if not online_next[j]:
+            offline += 1
+            first = j
+            j += 2
+            continue
+        keep[j] = False
+        j += 1
+        block = 16
+        while j < n:
+            js = numpy.arange(j, min(n, j + block))
+            off = numpy.flatnonzero(~online(first, js))
+            if len(off) > 0:
+                keep[j:j + off[0]] = False
+                j += off[0]
+                offline += 1
+                first = j
+                j += 2
+                break
+            keep[js] = False
+            j += len(js)
+            block *= 2
+    return keep, offline
+
+
+def canDoArcs(c):
+    """only post-processors which write arc_cw and arc_ccw moves can get fitted arcs,
+    the base creator drops them"""
+    return type(c).arc_cw is not nc.Creator.arc_cw and type(c).arc_ccw is not nc.Creator.arc_ccw
+
+
 def exportGcodePath(filename, vertslist, operations):
     """exports gcode with the heeks nc adopted library."""
     print("EXPORT")
@@ -311,36 +375,58 @@ def exportGcodePath(filename, vertslist, operations):
 
         scale_graph = 0.05  # warning this has to be same as in export in utils!!!!
 
-        ii = 0
+        # skip the first vertex if this is a chained operation
+        # ie: outputting more than one operation
+        # otherwise the machine gets sent back to 0,0 for each operation which is unecessary
+        start = 1 if i > 0 else 0
+        co = numpy.empty(len(verts) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get('co', co)
+        co = co.reshape(-1, 3)
+        vis = numpy.arange(start, len(verts))
         offline = 0
         online = 0
+        # redundant point on line detection
+        if o.remove_redundant_points and o.strategy != 'DRILL':
+            keep, offline = getRedundantPoints(co[start:], o.simplify_tol / 1000)
+            vis = vis[keep]
+            online = len(keep) - len(vis)
+        if o.machine_axes == '3' and len(vis) > 0:
+            # coordinates same as previous point are not written
+            kept = co[vis]
+            same = numpy.zeros((len(vis), 3), dtype=bool)
+            same[1:] = kept[1:] == kept[:-1]
+            if vis[0] > 0:
+                same[0] = kept[0] == numpy.array(last, dtype=numpy.float32)
+            same = same.tolist()
+
+        arcs = {}
+        if o.use_arc_fitting and not canDoArcs(c):
+            if 'arcs are written as lines' not in o.warnings:
+                o.warnings = o.warnings + 'post-processor can not do arcs, arcs are written as lines\n'
+                print('post-processor can not do arcs, arcs are written as lines')
+        elif o.use_arc_fitting and o.machine_axes == '3' and o.strategy != 'DRILL' and not fadjust and len(vis) > 0:
+            # only moves which would be written as milling moves can be replaced by arcs
+            vect = numpy.diff(kept, axis=0).astype(numpy.float64)
+            l = numpy.sqrt((vect * vect).sum(axis=1))
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                plunge = (l > 0) & (numpy.arccos(-vect[:, 2] / l) < plungelimit)
+            feedmove = numpy.zeros(len(vis), dtype=bool)
+            feedmove[1:] = ~plunge & (kept[1:, 2] < free_movement_height)
+            arcs = getArcs(kept, feedmove, o.arc_tolerance, getattr(c, 'can_do_helical_arcs', False))
+            inarc = numpy.zeros(len(vis), dtype=bool)
+            for e, arc in arcs.items():
+                inarc[arc[0] + 1:e] = True
+            print("arcs " + str(len(arcs)) + " replaced " + str(inarc.sum() + len(arcs)) + " moves")
+            inarc = inarc.tolist()
+
         cut = True  # active cut variable for laser or plasma
-        for vi, vert in enumerate(verts):
-            # skip the first vertex if this is a chained operation
-            # ie: outputting more than one operation
-            # otherwise the machine gets sent back to 0,0 for each operation which is unecessary
-            if i > 0 and vi == 0:
+        for k, vi in enumerate(vis.tolist()):
+            if arcs and inarc[k]:
                 continue
-            v = vert.co
-            # redundant point on line detection
-            if o.remove_redundant_points and o.strategy != 'DRILL':
-                nextv = v
-                if ii == 0:
-                    firstv = v  # only happens once
-                elif ii == 1:
-                    middlev = v
-                else:
-                    if pointonline(firstv, middlev, nextv, o.simplify_tol / 1000):
-                        middlev = nextv
-                        online += 1
-                        continue
-                    else:  # create new start point with the last tested point
-                        ii = 0
-                        offline += 1
-                        firstv = nextv
-                ii += 1
-            # end of redundant point on line detection
-            if o.machine_axes != '3':
+            v = verts[vi].co
+            if o.machine_axes == '3':
+                samex, samey, samez = same[k]
+            else:
                 v = v.copy()  # we rotate it so we need to copy the vector
                 r = Euler(rots[vi].co)
                 # conversion to N-axis coordinates
@@ -363,21 +449,15 @@ def exportGcodePath(filename, vertslist, operations):
                     rb = None
                 else:
                     rb = r.y * rotcorr
-            # rb=r.y*rotcorr
-            # print (	ra,rb)
+                # rb=r.y*rotcorr
+                # print (	ra,rb)
+                samex = vi > 0 and v.x == last.x
+                samey = vi > 0 and v.y == last.y
+                samez = vi > 0 and v.z == last.z
 
-            if vi > 0 and v.x == last.x:
-                vx = None
-            else:
-                vx = v.x * unitcorr
-            if vi > 0 and v.y == last.y:
-                vy = None
-            else:
-                vy = v.y * unitcorr
-            if vi > 0 and v.z == last.z:
-                vz = None
-            else:
-                vz = v.z * unitcorr
+            vx = None if samex else v.x * unitcorr
+            vy = None if samey else v.y * unitcorr
+            vz = None if samez else v.z * unitcorr
 
             if fadjust:
                 fadjustval = shapek.data[vi].co.z / scale_graph
@@ -385,7 +465,18 @@ def exportGcodePath(filename, vertslist, operations):
             # v=(v.x*unitcorr,v.y*unitcorr,v.z*unitcorr)
             vect = v - last
             l = vect.length
-            if vi > 0 and l > 0 and downvector.angle(vect) < plungelimit:
+            if k in arcs:
+                s, cx, cy, cw, l = arcs[k]
+                if f != millfeedrate:
+                    f = millfeedrate
+                    c.feedrate(f)
+                vz = None if v.z == last.z else v.z * unitcorr
+                if cw:
+                    c.arc_cw(x=v.x * unitcorr, y=v.y * unitcorr, z=vz, i=cx * unitcorr, j=cy * unitcorr)
+                else:
+                    c.arc_ccw(x=v.x * unitcorr, y=v.y * unitcorr, z=vz, i=cx * unitcorr, j=cy * unitcorr)
+
+            elif vi > 0 and l > 0 and downvector.angle(vect) < plungelimit:
                 # print('plunge')
                 # print(vect)
                 if f != plungefeedrate or (fadjust and fadjustval != 1):
@@ -456,7 +547,7 @@ def exportGcodePath(filename, vertslist, operations):
                     # print('normalf',ra,rb)
                     c.feed(x=vx, y=vy, z=vz, a=ra, b=rb)
 
-            duration += vect.length / f
+            duration += l / f
             # print(duration)
             last = v
             if o.machine_axes != '3':
@@ -515,26 +606,13 @@ def getPath(context, operation):  # should do all path calculations.
     if shapely.speedups.available:
         shapely.speedups.enable()
 
-    # these tags are for caching of some of the results. Not working well still
-    # - although it can save a lot of time during calculation...
-
-    chd = getChangeData(operation)
-    # print(chd)
-    # print(o.changedata)
-    if operation.changedata != chd:  # or 1:
-        operation.update_offsetimage_tag = True
-        operation.update_zbufferimage_tag = True
-        operation.changedata = chd
-
-    operation.update_silhouete_tag = True
-    operation.update_ambient_tag = True
-    operation.update_bullet_collision_tag = True
-
     utils.getOperationSources(operation)
 
     operation.warnings = ''
     checkMemoryLimit(operation)
 
+    operation.update_bullet_collision_tag = True
+
     print(operation.machine_axes)
 
     if operation.machine_axes == '3':
@@ -564,21 +642,64 @@ def getPath(context, operation):  # should do all path calculations.
     progress('total time', t1)
 
 
-def getChangeData(o):
-    """this is a function to check if object props have changed,
-    to see if image updates are needed in the image based method"""
-    changedata = ''
-    obs = []
-    if o.geometry_source == 'OBJECT':
-        obs = [bpy.data.objects[o.object_name]]
-    elif o.geometry_source == 'COLLECTION':
-        obs = bpy.data.collections[o.collection_name].objects
-    for ob in obs:
-        changedata += str(ob.location)
-        changedata += str(ob.rotation_euler)
-        changedata += str(ob.dimensions)
-
-    return changedata
+def getCacheKeys(o):
+    """content hashes of the inputs of every cached stage of the operation,
+    to see which of the images and polygons need an update"""
+    if o.geometry_source == 'IMAGE':
+        i = bpy.data.images[o.source_image_name]
+        geometry = hashValues(hashImage(i), o.source_image_crop, o.source_image_crop_start_x,
+                              o.source_image_crop_end_x, o.source_image_crop_start_y, o.source_image_crop_end_y,
+                              o.source_image_scale_z, o.source_image_size_x, tuple(o.source_image_offset),
+                              o.strategy == 'WATERLINE')
+        rendered = geometry
+    else:
+        # render always uses modifiers, silhouete only when asked.
+        rendered = hashObjects(o.objects)
+        if o.use_modifiers:
+            geometry = rendered
+        else:
+            geometry = hashObjects(o.objects, use_modifiers=False)
+
+    cutter = (o.cutter_type, o.cutter_diameter, o.skin, o.cutter_tip_angle, o.cylcone_diameter, o.ball_radius)
+    if o.cutter_type == 'CUSTOM':
+        cutter += (hashObjects([bpy.data.objects[o.cutter_object_name]]),)
+    limit = None
+    if o.use_limit_curve and o.limit_curve != '':
+        limit = hashObjects([bpy.data.objects[o.limit_curve]])
+
+    keys = {}
+    keys['zbuffer'] = hashValues(rendered, o.pixsize, o.borderwidth, tuple(o.min), tuple(o.max))
+    keys['offset'] = hashValues(keys['zbuffer'], cutter, o.inverse, o.minz)
+    keys['silhouete'] = hashValues(geometry, o.geometry_source, o.onlycurves, keys['zbuffer'], o.minz)
+    keys['ambient'] = hashValues(keys['silhouete'], o.ambient_behaviour, o.ambient_radius, o.ambient_cutter_restrict,
+                                 o.cutter_diameter, o.use_limit_curve, limit, o.circle_detail, o.straight,
+                                 o.dont_merge, tuple(o.min), tuple(o.max))
+    return keys
+
+
+def updateCacheTags(o):
+    """these tags are for caching of some of the results, every stage is recomputed only when its inputs changed.
+    changedata holds the keys of the last finished calculation, stages being recomputed are
+    forgotten first, so an interrupted calculation can't leave a stale cache behind.
+    needs the bounds of the operation, returns the keys to store when the calculation finishes"""
+    keys = getCacheKeys(o)
+    try:
+        oldkeys = json.loads(o.changedata)
+    except ValueError:
+        oldkeys = {}
+    o.update_zbufferimage_tag = keys['zbuffer'] != oldkeys.get('zbuffer')
+    o.update_offsetimage_tag = keys['offset'] != oldkeys.get('offset')
+    image_utils.setImageCacheKeys(o, {'_z': keys['zbuffer'], '_off': keys['offset']})
+    # silhouete and ambient aren't saved with the operation, so they are looked up in memory instead
+    utils.restoreOperationPolygons(o, keys)
+    o.changedata = json.dumps({k: oldkeys.get(k) for k in keys if keys[k] == oldkeys.get(k)})
+    return keys
+
+
+def storeCacheKeys(o, keys):
+    """marks the cached data of a finished calculation as valid"""
+    utils.storeOperationPolygons(o, keys)
+    o.changedata = json.dumps(keys)
 
 
 def checkMemoryLimit(o):
@@ -603,6 +724,7 @@ def getPath3axis(context, operation):
     s = bpy.context.scene
     o = operation
     utils.getBounds(o)
+    keys = updateCacheTags(o)
 
     if o.strategy == 'CUTOUT':
         strategy.cutout(o)
@@ -723,17 +845,19 @@ def getPath3axis(context, operation):
         slicesfilled = 0
         utils.getAmbient(o)
 
+        slicezs = [o.minz + h * o.slice_detail for h in range(0, nslices)]
+        if nslices > 0:
+            slicezs[0] += 0.0000001
+            # if people do mill flat areas, this helps to reach those...
+            # otherwise first layer would actually be one slicelevel above min z.
+        progress('outlining slices')
+        allslicepolys = getSlicePolygons(o, o.offset_image, slicezs, with_border=True)
+
         for h in range(0, nslices):
             layerstepinc += 1
             slicechunks = []
-            z = o.minz + h * o.slice_detail
-            if h == 0:
-                z += 0.0000001
-                # if people do mill flat areas, this helps to reach those...
-                # otherwise first layer would actually be one slicelevel above min z.
-
-            islice = o.offset_image > z
-            slicepolys = imageToShapely(o, islice, with_border=True)
+            z = slicezs[h]
+            slicepolys = allslicepolys[h]
 
             poly = spolygon.Polygon()  # polygversion
             lastchunks = []
@@ -841,10 +965,13 @@ def getPath3axis(context, operation):
     elif o.strategy == 'MEDIAL_AXIS':
         strategy.medial_axis(o)
 
+    storeCacheKeys(o, keys)
+
 
 def getPath4axis(context, operation):
     o = operation
     utils.getBounds(o)
+    keys = updateCacheTags(o)
     if o.strategy4axis in ['PARALLELR', 'PARALLEL', 'HELIX', 'CROSS']:
         path_samples = getPathPattern4axis(o)
 
@@ -855,3 +982,5 @@ def getPath4axis(context, operation):
 
         chunks.extend(utils.sampleChunksNAxis(o, path_samples, layers))
         strategy.chunksToMesh(chunks, o)
+
+    storeCacheKeys(o, keys)
@@ -23,8 +23,15 @@ import numpy
 import math
 import time
 import random
+import os
+import sys
+import glob
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
 
-import curve_simplify
 import mathutils
 from mathutils import *
 
@@ -32,6 +39,8 @@ from cam import simple
 from cam.simple import *
 from cam import chunk
 from cam.chunk import *
+from cam.workers.camSampling import getSampleImageArray, getSamplePoints
+from cam.workers.camOutline import getImageOutlines, simplifyOutlines
 from cam import simulation
 
 
@@ -69,6 +78,79 @@ def getCircleBinary(r):
 
 # get cutters for the z-buffer image method
 
+# images of recently computed operations, the arrays stay untouched once they are here.
+IMAGE_CACHE_SIZE = 8
+_image_cache = OrderedDict()
+# cache keys of the images each operation computes, by operation name and image suffix
+_image_keys = {}
+
+
+def setImageCacheKeys(o, keys):
+    """sets the cache keys of the operation images, they are part of the cached file names,
+    so a file is never loaded for other inputs than it was made from"""
+    _image_keys[o.name] = keys
+
+
+def getImageCachePath(o, suffix):
+    key = _image_keys.get(o.name, {}).get(suffix)
+    if key is None:
+        return None
+    return getCachePath(o) + suffix + '_' + key + '.npy'
+
+
+def cacheImage(o, a, suffix):
+    """stores operation image in memory and as raw .npy file next to the blend file"""
+    iname = getImageCachePath(o, suffix)
+    if iname is None:
+        return
+    # the file may still be memory mapped by the operation. it can't be replaced on windows then,
+    # and truncating it on other systems breaks the mapped array.
+    _image_cache.pop(iname, None)
+    for name in ('zbuffer_image', 'offset_image'):
+        b = getattr(o, name)
+        if isinstance(b, numpy.memmap) and b.filename == os.path.abspath(iname):
+            setattr(o, name, numpy.array(b))
+    _image_cache[iname] = a
+    while len(_image_cache) > IMAGE_CACHE_SIZE:
+        _image_cache.popitem(last=False)
+
+    tname = iname[:-4] + '_tmp.npy'
+    try:
+        os.makedirs(os.path.dirname(iname), exist_ok=True)
+        numpy.save(tname, a)
+        os.replace(tname, iname)
+    except OSError:
+        print('image cache not written ' + iname)
+        if os.path.exists(tname):
+            os.remove(tname)
+        return
+    # files of older keys aren't needed anymore
+    pattern = glob.escape(getCachePath(o) + suffix + '_') + '[0-9a-f]' * len(_image_keys[o.name][suffix]) + '.npy'
+    for oldname in glob.glob(pattern):
+        if oldname != iname:
+            try:
+                os.remove(oldname)
+            except OSError:
+                pass
+
+
+def getCachedImage(o, suffix):
+    """operation image from memory or memory mapped .npy file, None if it isn't cached for the current key"""
+    iname = getImageCachePath(o, suffix)
+    if iname is None:
+        return None
+    if iname in _image_cache:
+        _image_cache.move_to_end(iname)
+        return _image_cache[iname]
+    try:
+        a = numpy.load(iname, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    _image_cache[iname] = a
+    while len(_image_cache) > IMAGE_CACHE_SIZE:
+        _image_cache.popitem(last=False)
+    return a
+
 
 def numpysave(a, iname):
     inamebase = bpy.path.basename(iname)
@@ -135,11 +217,105 @@ def imagetonumpy(i):
     return na
 
 
+def maskSpans(mask):
+    """row spans (row, start, length) of a footprint, None if some row isn't contiguous"""
+    spans = []
+    for x in range(mask.shape[0]):
+        ys = numpy.nonzero(mask[x])[0]
+        if len(ys) > 0:
+            if ys[-1] - ys[0] + 1 != len(ys):
+                return None
+            spans.append((x, ys[0], len(ys)))
+    return spans
+
+
+def flatDilate(sourceArray, spans, w, h):
+    """maximum of sourceArray over a flat footprint given by row spans, for all w*h footprint positions.
+    running maximums along rows are built by doubling, so each span costs one array operation."""
+    result = None
+    level = sourceArray
+    p = 1
+    for length in sorted(set(s[2] for s in spans)):
+        while p * 2 <= length:
+            level = numpy.maximum(level[:, :-p], level[:, p:])
+            p *= 2
+        if length == p:
+            runmax = level
+        else:
+            runmax = numpy.maximum(level[:, :p - length], level[:, length - p:])
+        for x, lo, l in spans:
+            if l == length:
+                if result is None:
+                    result = runmax[x:x + w, lo:lo + h].copy()
+                else:
+                    numpy.maximum(result, runmax[x:x + w, lo:lo + h], result)
+    return result
+
+
+def offsetAreaGeneric(sourceArray, cutterArray, comparearea):
+    """offset by any cutter shape, one image maximum per cutter pixel."""
+    w, h = comparearea.shape
+    cwidth = len(cutterArray)
+    for x in range(0, cwidth):  # cwidth):
+        simple.progress('offset ', int(x * 100 / cwidth))
+        for y in range(0, cwidth):
+            if cutterArray[x, y] > -10:
+                numpy.maximum(sourceArray[x: w + x, y: h + y] + cutterArray[x, y], comparearea, comparearea)
+
+
+def offsetAreaRadial(sourceArray, cutterArray, comparearea, bands=8):
+    """offset by a cutter whose profile only falls with distance from its axis (END, BALL, VCARVE...).
+    The top plateau (whole END cutter, cylinder of CYLCONE) is a flat disc dilation.
+    The rest is split into rings. A ring is evaluated only on positions where the flat maximum
+    under its disc plus the ring's highest cutter value can still raise the result, so flat and
+    gently sloped areas skip the outer rings. Gives exactly the same values as offsetAreaGeneric."""
+    w, h = comparearea.shape
+    cwidth = len(cutterArray)
+    c = numpy.arange(cwidth) + 0.5 - cwidth / 2.0
+    dist = numpy.hypot(c.reshape(-1, 1), c.reshape(1, -1))
+    valid = cutterArray > -10
+    top = cutterArray[valid].max()
+    plateau = valid & (cutterArray == top)
+
+    spans = maskSpans(plateau)
+    if spans is None:
+        offsetAreaGeneric(sourceArray, cutterArray, comparearea)
+        return
+    numpy.maximum(flatDilate(sourceArray, spans, w, h) + top, comparearea, comparearea)
+
+    rest = valid & ~plateau
+    if not rest.any():
+        return
+    edges = numpy.linspace(dist[rest].min(), dist[rest].max(), bands + 1)
+    bandindex = numpy.clip(numpy.searchsorted(edges, dist, side='right') - 1, 0, bands - 1)
+    flatsource = numpy.ascontiguousarray(sourceArray).ravel()
+    height = sourceArray.shape[1]
+    for b in range(bands):
+        simple.progress('offset ', int(b * 100 / bands))
+        band = rest & (bandindex == b)
+        if not band.any():
+            continue
+        spans = maskSpans(valid & (dist <= dist[band].max()))
+        if spans is not None:
+            bound = flatDilate(sourceArray, spans, w, h) + cutterArray[band].max()
+            active = numpy.nonzero(bound > comparearea)
+        if spans is None or len(active[0]) > comparearea.size / 2:  # steep areas, slices are faster than picking
+            for x, y in zip(*numpy.nonzero(band)):
+                numpy.maximum(sourceArray[x: w + x, y: h + y] + cutterArray[x, y], comparearea, comparearea)
+            continue
+        base = active[0] * height + active[1]
+        activearea = comparearea[active]
+        for x, y in zip(*numpy.nonzero(band)):
+            numpy.maximum(flatsource[base + (x * height + y)] + cutterArray[x, y], activearea, activearea)
+        comparearea[active] = activearea
+
+
 def offsetArea(o, samples):
     """ offsets the whole image with the cutter + skin offsets """
     if o.update_offsetimage_tag:
         minx, miny, minz, maxx, maxy, maxz = o.min.x, o.min.y, o.min.z, o.max.x, o.max.y, o.max.z
-        o.offset_image.fill(-10)
+        # always a new array, the old one can be cached or memory mapped read only.
+        o.offset_image = numpy.full(samples.shape, -10.0)
 
         sourceArray = samples
         cutterArray = simulation.getCutterArray(o, o.pixsize)
@@ -158,21 +334,10 @@ def offsetArea(o, samples):
             sourceArray = -sourceArray + minz
         print(o.offset_image.shape)
         comparearea = o.offset_image[m: width - cwidth + m, m:height - cwidth + m]
-        # i=0
-        for x in range(0, cwidth):  # cwidth):
-            text = "Offsetting depth " + str(int(x * 100 / cwidth))
-            # o.operator.report({"INFO"}, text)
-            simple.progress('offset ', int(x * 100 / cwidth))
-            for y in range(0, cwidth):
-                # TODO:OPTIMIZE THIS - this can run much faster when the areas won't be created each run????
-                #  tests dont work now
-                if cutterArray[x, y] > -10:
-                    # i+=1
-                    # progress(i)
-                    # winner
-                    numpy.maximum(sourceArray[x: width - cwidth + x, y: height - cwidth + y] + cutterArray[x, y],
-                                  comparearea, comparearea)
-                    # contest of performance
+        if o.cutter_type == 'CUSTOM':  # custom cutters can have any shape
+            offsetAreaGeneric(sourceArray, cutterArray, comparearea)
+        else:
+            offsetAreaRadial(sourceArray, cutterArray, comparearea)
 
         o.offset_image[m: width - cwidth + m, m:height - cwidth + m] = comparearea
         # progress('offseting done')
@@ -194,154 +359,182 @@ def getOffsetImageCavities(o, i):  # for pencil operation mainly
     """detects areas in the offset image which are 'cavities' - the curvature changes."""
     # i=numpy.logical_xor(lastislice , islice)
     simple.progress('detect corners in the offset image')
+    # second differences of the heights over the threshold, in both directions
+    ar = numpy.zeros(i.shape, dtype=bool)
     vertical = i[:-2, 1:-1] - i[1:-1, 1:-1] - o.pencil_threshold > i[1:-1, 1:-1] - i[2:, 1:-1]
     horizontal = i[1:-1, :-2] - i[1:-1, 1:-1] - o.pencil_threshold > i[1:-1, 1:-1] - i[1:-1, 2:]
-    # if bpy.app.debug_value==2:
-
-    ar = numpy.logical_or(vertical, horizontal)
+    ar[1:-1, 1:-1] = numpy.logical_or(vertical, horizontal)
 
-    if 1:  # this is newer strategy, finds edges nicely, but pff.going exacty on edge,
-        # it has tons of spikes and simply is not better than the old one
-        iname = simple.getCachePath(o) + '_pencilthres.exr'
-        # numpysave(ar,iname)#save for comparison before
-        chunks = imageEdgeSearch_online(o, ar, i)
-        iname = simple.getCachePath(o) + '_pencilthres_comp.exr'
-        print("new pencil strategy")
+    chunks = imageEdgeSearch_online(o, ar, i)
 
     # ##crop pixels that are on outer borders
     for chi in range(len(chunks) - 1, -1, -1):
         chunk = chunks[chi]
-        for si in range(len(chunk.points) - 1, -1, -1):
-            if not (o.min.x < chunk.points[si][0] < o.max.x and o.min.y < chunk.points[si][1] < o.max.y):
-                chunk.points.pop(si)
+        a = numpy.array(chunk.points)
+        inside = (o.min.x < a[:, 0]) & (a[:, 0] < o.max.x) & (o.min.y < a[:, 1]) & (a[:, 1] < o.max.y)
+        chunk.setPointsArray(a[inside])
         if len(chunk.points) < 2:
             chunks.pop(chi)
 
     return chunks
 
 
-def imageEdgeSearch_online(o, ar, zimage):  # search edges for pencil strategy, another try.
-    minx, miny, minz, maxx, maxy, maxz = o.min.x, o.min.y, o.min.z, o.max.x, o.max.y, o.max.z
-    r = ceil((o.cutter_diameter/12)/o.pixsize)   # was commented
-    coef = 0.75
-    maxarx = ar.shape[0]
-    maxary = ar.shape[1]
-
-    directions = ((-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0))
-
-    indices = ar.nonzero()  # first get white pixels
-    startpix = ar.sum()
-    totpix = startpix
-    chunks = []
-    xs = indices[0][0]
-    ys = indices[1][0]
-    nchunk = camPathChunk([(xs, ys, zimage[xs, ys])])  # startposition
-    dindex = 0  # index in the directions list
-    last_direction = directions[dindex]
-    test_direction = directions[dindex]
-    i = 0
-    perc = 0
-    itests = 0
-    totaltests = 0
-    maxtotaltests = startpix * 4
-
-    ar[xs, ys] = False
-
-    while totpix > 0 and totaltests < maxtotaltests:  # a ratio when the algorithm is allowed to end
-
-        if perc != int(100 - 100 * totpix / startpix):
-            perc = int(100 - 100 * totpix / startpix)
-            simple.progress('pencil path searching', perc)
-        # progress('simulation ',int(100*i/l))
-        success = False
-        testangulardistance = 0  # distance from initial direction in the list of direction
-        testleftright = False  # test both sides from last vector
-        while not success:
-            xs = nchunk.points[-1][0] + test_direction[0]
-            ys = nchunk.points[-1][1] + test_direction[1]
-
-            if xs > r and xs < ar.shape[0] - r and ys > r and ys < ar.shape[1] - r:
-                test = ar[xs, ys]
-                # print(test)
-                if test:
-                    success = True
-            if success:
-                nchunk.points.append([xs, ys, zimage[xs, ys]])
-                last_direction = test_direction
-                ar[xs, ys] = False
-                if 0:
-                    print('success')
-                    print(xs, ys, testlength, testangle)
-                    print(lastvect)
-                    print(testvect)
-                    print(itests)
+def getPixelNeighbours(xs, ys, offsets):
+    """indices of the neighbours of pixels xs, ys in directions offsets, -1 where there is none.
+    pixels have to be ordered like numpy.nonzero returns them"""
+    n = len(xs)
+    h = int(ys.max()) + 3
+    pixels = (xs + 1) * h + ys + 1  # as in a padded image, so neighbours never wrap around
+    neighbours = []
+    for dx, dy in offsets:
+        p = pixels + dx * h + dy
+        j = numpy.minimum(numpy.searchsorted(pixels, p), n - 1)
+        neighbours.append(numpy.where(pixels[j] == p, j, -1))
+    return numpy.array(neighbours).reshape(len(offsets), n)
+
+
+def labelPixels(neighbours):
+    """labels of connected components of pixels, from the neighbour indices of getPixelNeighbours.
+    every pixel gets the lowest index of its component"""
+    labels = numpy.arange(neighbours.shape[1])
+    while True:
+        lowest = labels.copy()
+        for nb in neighbours:
+            linked = nb >= 0
+            lowest[linked] = numpy.minimum(lowest[linked], labels[nb[linked]])
+        # the labels pixels point to also take the lowest one, then pointers are followed to their ends
+        numpy.minimum.at(lowest, labels, lowest)
+        while True:
+            jumped = lowest[lowest]
+            if (jumped == lowest).all():
+                break
+            lowest = jumped
+        if (lowest == labels).all():
+            return labels
+        labels = lowest
+
+
+# neighbours going around a pixel, starting above it
+AROUND_PIXEL = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+
+def thinImage(ar):
+    """Zhang-Suen thinning of a boolean image to lines one pixel wide.
+    only the set pixels are tested, so it costs as much as there are of them, not as the image size"""
+    a = numpy.pad(ar, 1)
+    xs, ys = numpy.nonzero(a)
+    allxs, allys = xs, ys
+    removed = True
+    while removed:
+        removed = False
+        for step in (0, 1):
+            n = numpy.array([a[xs + dx, ys + dy] for dx, dy in AROUND_PIXEL])
+            count = n.sum(axis=0)
+            transitions = (~n & numpy.roll(n, -1, axis=0)).sum(axis=0)
+            if step == 0:
+                side = ~(n[0] & n[2] & n[4]) & ~(n[2] & n[4] & n[6])
             else:
-                # nchunk.append([xs,ys])#for debugging purpose
-                # ar.shape[0]
-                test_direction = last_direction
-                if testleftright:
-                    testangulardistance = -testangulardistance
-                    testleftright = False
-                else:
-                    testangulardistance = -testangulardistance
-                    testangulardistance += 1  # increment angle
-                    testleftright = True
-
-                if abs(testangulardistance) > 6:  # /testlength
-                    testangulardistance = 0
-                    indices = ar.nonzero()
-                    totpix = len(indices[0])
-                    chunks.append(nchunk)
-                    if len(indices[0] > 0):
-                        xs = indices[0][0]
-                        ys = indices[1][0]
-                        nchunk = camPathChunk([(xs, ys, zimage[xs, ys])])  # startposition
-
-                        ar[xs, ys] = False
-                    else:
-                        nchunk = camPathChunk([])
+                side = ~(n[0] & n[2] & n[6]) & ~(n[0] & n[4] & n[6])
+            remove = (count >= 2) & (count <= 6) & (transitions == 1) & side
+            if remove.any():
+                a[xs[remove], ys[remove]] = False
+                xs = xs[~remove]
+                ys = ys[~remove]
+                removed = True
+
+    # small areas like 2x2 squares are thinned to one pixel or none. they keep the pixel closest to their middle
+    # and its furthest neighbour instead, so they still get a path
+    if len(allxs) > 0:
+        labels = labelPixels(getPixelNeighbours(allxs, allys, AROUND_PIXEL))
+        thinned = numpy.bincount(labels[a[allxs, allys]], minlength=len(allxs)) > 1
+        lost = numpy.flatnonzero(~thinned[labels])
+        if len(lost) > 0:
+            lx, ly, ll = allxs[lost], allys[lost], labels[lost]
+
+            def firstOfAreas(values):
+                order = numpy.lexsort((values, ll))
+                return order[numpy.concatenate(([True], numpy.diff(ll[order]) > 0))]
+
+            counts = numpy.bincount(ll)[ll]
+            middle = firstOfAreas((lx - numpy.bincount(ll, lx)[ll] / counts) ** 2 +
+                                  (ly - numpy.bincount(ll, ly)[ll] / counts) ** 2)
+            middleof = numpy.zeros(ll.max() + 1, dtype=int)
+            middleof[ll[middle]] = middle
+            dx = lx - lx[middleof[ll]]
+            dy = ly - ly[middleof[ll]]
+            touching = (numpy.abs(dx) <= 1) & (numpy.abs(dy) <= 1)
+            furthest = firstOfAreas(-numpy.where(touching, dx * dx + dy * dy, -1))
+            a[lx, ly] = False
+            a[lx[middle], ly[middle]] = True
+            a[lx[furthest], ly[furthest]] = True
+    return a[1:-1, 1:-1]
+
+
+def getSkeletonPaths(skeleton):
+    """pixel paths along a skeleton image, made by walking its connected components one after another.
+    each component is walked from its line ends first, so branches become separate paths joined at crossings"""
+    xs, ys = numpy.nonzero(skeleton)
+    n = len(xs)
+    if n == 0:
+        return []
+    orthogonal = ((0, 1), (1, 0), (0, -1), (-1, 0))
+    diagonal = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+    near = getPixelNeighbours(xs, ys, orthogonal + diagonal)
+    labels = labelPixels(near)
+    for k, (dx, dy) in enumerate(diagonal):
+        # diagonal steps are left out where two orthogonal ones go around the corner
+        d = near[4 + k]
+        d[(near[orthogonal.index((dx, 0))] >= 0) | (near[orthogonal.index((0, dy))] >= 0)] = -1
+    near = near.T
+    degree = (near >= 0).sum(axis=1)
+    near = [[j for j in row if j >= 0] for row in near.tolist()]
+
+    # line ends of each component first, then its other pixels for closed loops
+    order = numpy.lexsort((degree != 1, labels)).tolist()
+    visited = numpy.zeros(n, dtype=bool)
+    paths = []
+    for start in order:
+        if visited[start]:
+            continue
+        visited[start] = True
+        path = [start]
+        current = start
+        while True:
+            following = [j for j in near[current] if not visited[j]]
+            if len(following) == 0:
+                break
+            current = following[0]
+            visited[current] = True
+            path.append(current)
+        # join the path to the pixels it ran into, or close the loop
+        if len(path) > 1:
+            ends = [j for j in near[current] if j != path[-2]]
+            if len(ends) > 0:
+                path.append(ends[0])
+        paths.append(numpy.array(path))
+    return [numpy.column_stack((xs[p], ys[p])) for p in paths]
 
-                    test_direction = directions[3]
-                    last_direction = directions[3]
-                    success = True
-                    itests = 0
-                # print('reset')
-                if len(nchunk.points) > 0:
-                    if nchunk.points[-1][0] + test_direction[0] < r:
-                        testvect.x = r
-                    if nchunk.points[-1][1] + test_direction[1] < r:
-                        testvect.y = r
-                    if nchunk.points[-1][0] + test_direction[0] > maxarx - r:
-                        testvect.x = maxarx - r
-                    if nchunk.points[-1][1] + test_direction[1] > maxary - r:
-                        testvect.y = maxary - r
-
-                dindexmod = dindex + testangulardistance
-                while dindexmod < 0:
-                    dindexmod += len(directions)
-                while dindexmod > len(directions):
-                    dindexmod -= len(directions)
-
-                test_direction = directions[dindexmod]
-                if 0:
-                    print(xs, ys, test_direction, last_direction, testangulardistance)
-                    print(totpix)
-            itests += 1
-            totaltests += 1
 
-        i += 1
-        if i % 100 == 0:
-            # print('100 succesfull tests done')
-            totpix = ar.sum()
-            # print(totpix)
-            # print(totaltests)
-            i = 0
-    chunks.append(nchunk)
-    for ch in chunks:
-        ch = ch.points
-        for i in range(0, len(ch)):
-            ch[i] = ((ch[i][0] + coef - o.borderwidth) * o.pixsize + minx,
-                     (ch[i][1] + coef - o.borderwidth) * o.pixsize + miny, ch[i][2])
+def imageEdgeSearch_online(o, ar, zimage):  # search edges for pencil strategy, another try.
+    """chunks along the cavities marked in ar, thinned to their middle lines"""
+    minx, miny = o.min.x, o.min.y
+    r = ceil((o.cutter_diameter/12)/o.pixsize)   # was commented
+    # pixels near the image border are left out
+    ar = ar.copy()
+    ar[:r + 1] = False
+    ar[ar.shape[0] - r:] = False
+    ar[:, :r + 1] = False
+    ar[:, ar.shape[1] - r:] = False
+
+    simple.progress('pencil path searching')
+    chunks = []
+    for path in getSkeletonPaths(thinImage(ar)):
+        points = numpy.empty((len(path), 3))
+        points[:, :2] = (path - o.borderwidth) * o.pixsize + (minx, miny)
+        points[:, 2] = zimage[path[:, 0], path[:, 1]]
+        chunk = camPathChunk([])
+        chunk.setPointsArray(points)
+        chunks.append(chunk)
     return chunks
 
 
@@ -457,8 +650,8 @@ def crazyStrokeImage(o):
         testlength = r
 
         while not success:
-            xs = nchunk.points[-1][0] + int(testvect.x)
-            ys = nchunk.points[-1][1] + int(testvect.y)
+            xs = int(nchunk.points[-1][0]) + int(testvect.x)
+            ys = int(nchunk.points[-1][1]) + int(testvect.y)
             if xs > r + 1 and xs < ar.shape[0] - r - 1 and ys > r + 1 and ys < ar.shape[1] - r - 1:
                 testar = ar[xs - r:xs - r + d, ys - r:ys - r + d] * cutterArray
                 if 0:
@@ -560,10 +753,9 @@ def crazyStrokeImage(o):
             i = 0
     chunks.append(nchunk)
     for ch in chunks:
-        ch = ch.points
-        for i in range(0, len(ch)):
-            ch[i] = ((ch[i][0] + coef - o.borderwidth) * o.pixsize + minx,
-                     (ch[i][1] + coef - o.borderwidth) * o.pixsize + miny, 0)
+        a = ch.pointsArray()
+        ch.setPointsArray(numpy.column_stack(((a[:, :2] + coef - o.borderwidth) * o.pixsize + (minx, miny),
+                                              numpy.full(len(a), 0))))
     return chunks
 
 
@@ -819,26 +1011,15 @@ def crazyStrokeImageBinary(o, ar, avoidar):
         chunks.append(nchunk)
 
     for ch in chunks:
-        ch = ch.points
-        for i in range(0, len(ch)):
-            ch[i] = ((ch[i][0] + coef - o.borderwidth) * o.pixsize + minx,
-                     (ch[i][1] + coef - o.borderwidth) * o.pixsize + miny, o.minz)
+        a = ch.pointsArray()
+        ch.setPointsArray(numpy.column_stack(((a[:, :2] + coef - o.borderwidth) * o.pixsize + (minx, miny),
+                                              numpy.full(len(a), o.minz))))
 
     return chunks
 
 
-def imageToChunks(o, image, with_border=False):
-    t = time.time()
-    minx, miny, minz, maxx, maxy, maxz = o.min.x, o.min.y, o.min.z, o.max.x, o.max.y, o.max.z
-    pixsize = o.pixsize
-
-    image = image.astype(numpy.uint8)
-
-    # progress('detecting outline')
-    edges = []
-    ar = image[:, :-1] - image[:, 1:]
-
-    indices1 = ar.nonzero()
+def getOutlineBorder(o, with_border=False):
+    """pixels along the image border where outlines are left out"""
     borderspread = 2
     # o.cutter_diameter/o.pixsize#when the border was excluded precisely, sometimes it did remove some silhouette parts
     r = o.borderwidth - borderspread
@@ -846,156 +1027,27 @@ def imageToChunks(o, image, with_border=False):
     if with_border:
         #   print('border')
         r = 0
-    w = image.shape[0]
-    h = image.shape[1]
-    coef = 0.75  # compensates for imprecisions
-    for id in range(0, len(indices1[0])):
-        a = indices1[0][id]
-        b = indices1[1][id]
-        if r < a < w - r and r < b < h - r:
-            edges.append(((a - 1, b), (a, b)))
-
-    ar = image[:-1, :] - image[1:, :]
-    indices2 = ar.nonzero()
-    for id in range(0, len(indices2[0])):
-        a = indices2[0][id]
-        b = indices2[1][id]
-        if r < a < w - r and r < b < h - r:
-            edges.append(((a, b - 1), (a, b)))
-
-    polychunks = []
-    # progress(len(edges))
-
-    d = {}
-    for e in edges:
-        d[e[0]] = []
-        d[e[1]] = []
-    for e in edges:
-        verts1 = d[e[0]]
-        verts2 = d[e[1]]
-        verts1.append(e[1])
-        verts2.append(e[0])
-
-    if len(edges) > 0:
-
-        ch = [edges[0][0], edges[0][1]]  # first and his reference
-
-        d[edges[0][0]].remove(edges[0][1])
-
-        i = 0
-        specialcase = 0
-        # progress('condensing outline')
-        while len(
-                d) > 0 and i < 20000000:
-            verts = d.get(ch[-1], [])
-            closed = False
-            # print(verts)
-
-            if len(verts) <= 1:  # this will be good for not closed loops...some time
-                closed = True
-                if len(verts) == 1:
-                    ch.append(verts[0])
-                    verts.remove(verts[0])
-            elif len(verts) >= 3:
-                specialcase += 1
-                v1 = ch[-1]
-                v2 = ch[-2]
-                white = image[v1[0], v1[1]]
-                comesfromtop = v1[1] < v2[1]
-                comesfrombottom = v1[1] > v2[1]
-                comesfromleft = v1[0] > v2[0]
-                comesfromright = v1[0] < v2[0]
-                take = False
-                for v in verts:
-                    if v[0] == ch[-2][0] and v[1] == ch[-2][1]:
-                        pass
-                        verts.remove(v)
-
-                    if not take:
-                        if (not white and comesfromtop) or (white and comesfrombottom):  # goes right
-                            if v1[0] + 0.5 < v[0]:
-                                take = True
-                        elif (not white and comesfrombottom) or (white and comesfromtop):  # goes left
-                            if v1[0] > v[0] + 0.5:
-                                take = True
-                        elif (not white and comesfromleft) or (white and comesfromright):  # goes down
-                            if v1[1] > v[1] + 0.5:
-                                take = True
-                        elif (not white and comesfromright) or (white and comesfromleft):  # goes up
-                            if v1[1] + 0.5 < v[1]:
-                                take = True
-                        if take:
-                            ch.append(v)
-                            verts.remove(v)
-
-            else:  # here it has to be 2 always
-                done = False
-                for vi in range(len(verts) - 1, -1, -1):
-                    if not done:
-                        v = verts[vi]
-                        if v[0] == ch[-2][0] and v[1] == ch[-2][1]:
-                            pass
-                            verts.remove(v)
-                        else:
-
-                            ch.append(v)
-                            done = True
-                            verts.remove(v)
-                            if v[0] == ch[0][0] and v[1] == ch[0][1]:  # or len(verts)<=1:
-                                closed = True
-
-            if closed:
-                polychunks.append(ch)
-                for si, s in enumerate(ch):
-                    # print(si)
-                    if si > 0:  # first one was popped
-                        if d.get(s, None) is not None and len(d[s]) == 0:
-                            # this makes the case much less probable, but i think not impossible
-                            d.pop(s)
-                if len(d) > 0:
-                    newch = False
-                    while not newch:
-                        v1 = d.popitem()
-                        if len(v1[1]) > 0:
-                            ch = [v1[0], v1[1][0]]
-                            newch = True
-
-            # print(' la problema grandiosa')
-            i += 1
-            if i % 10000 == 0:
-                print(len(ch))
-                # print(polychunks)
-                print(i)
-
-        vecchunks = []
-
-        for ch in polychunks:
-            vecchunk = []
-            vecchunks.append(vecchunk)
-            for i in range(0, len(ch)):
-                ch[i] = ((ch[i][0] + coef - o.borderwidth) * pixsize + minx,
-                         (ch[i][1] + coef - o.borderwidth) * pixsize + miny, 0)
-                vecchunk.append(Vector(ch[i]))
-        # print('optimizing outline')
-
-        # print('directsimplify')
-        reduxratio = 1.25  # was 1.25
-        soptions = ['distance', 'distance', o.pixsize * reduxratio, 5, o.pixsize * reduxratio]
-        nchunks = []
-        for i, ch in enumerate(vecchunks):
-
-            s = curve_simplify.simplify_RDP(ch, soptions)
-            # print(s)
+    return r
+
+
+OUTLINE_SIMPLIFY_PIXELS = 1.25  # outline simplification tolerance in pixels
+
+
+def outlinesToChunks(o, outlines):
+    """chunks in operation coordinates from image outlines in pixel coordinates"""
+    nchunks = []
+    for outline in outlines:
+        if len(outline) > 2:
+            points = (outline - o.borderwidth) * o.pixsize + (o.min.x, o.min.y)
             nch = camPathChunk([])
-            for i in range(0, len(s)):
-                nch.points.append((ch[s[i]].x, ch[s[i]].y))
+            nch.points = list(map(tuple, points.tolist()))
+            nchunks.append(nch)
+    return nchunks
 
-            if len(nch.points) > 2:
-                nchunks.append(nch)
 
-        return nchunks
-    else:
-        return []
+def imageToChunks(o, image, with_border=False):
+    outlines = getImageOutlines(image, getOutlineBorder(o, with_border))
+    return outlinesToChunks(o, simplifyOutlines(outlines, OUTLINE_SIMPLIFY_PIXELS))
 
 
 def imageToShapely(o, i, with_border=False):
@@ -1005,6 +1057,43 @@ def imageToShapely(o, i, with_border=False):
     return polys
 
 
+def getSliceOutlinesPool(image, zs, r, processes):
+    """outlines of image slices above heights zs, traced by worker processes attached to the image in shared memory"""
+    # workers import the module standalone, importing it from the cam package would need bpy
+    worker_path = os.path.join(os.path.dirname(__file__), 'workers')
+    if worker_path not in sys.path:
+        sys.path.append(worker_path)
+    import camOutline as worker
+
+    image_shm, shared = sharedArray(image)
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=worker.init_worker,
+                                 initargs=(image_shm.name, shared.shape)) as executor:
+            # map keeps the slices in z order
+            outlines = list(executor.map(worker.slice_outlines, [(z, r, OUTLINE_SIMPLIFY_PIXELS) for z in zs]))
+        del shared
+        return outlines
+    finally:
+        image_shm.close()
+        image_shm.unlink()
+
+
+def getSlicePolygons(o, image, zs, with_border=False):
+    """polygons of image parts above each of heights zs, slices are traced in worker processes when there are more"""
+    r = getOutlineBorder(o, with_border)
+    processes = min(os.cpu_count() or 1, len(zs))
+    outlines = None
+    if processes > 1:
+        try:
+            outlines = getSliceOutlinesPool(image, zs, r, processes)
+        except (OSError, ImportError, BrokenProcessPool) as e:
+            print('slicing worker processes failed, slicing here', e)
+    if outlines is None:
+        outlines = [simplifyOutlines(getImageOutlines(image, r, z), OUTLINE_SIMPLIFY_PIXELS) for z in zs]
+    return [chunksToShapely(outlinesToChunks(o, polychunks)) for polychunks in outlines]
+
+
 def getSampleImage(s, sarray, minz):
     x = s[0]
     y = s[1]
@@ -1026,6 +1115,61 @@ def getSampleImage(s, sarray, minz):
         return z
 
 
+SAMPLING_POOL_MIN_POINTS = 1000000  # below this, starting worker processes costs more than it saves
+SAMPLING_TILE_POINTS = 250000
+
+
+def sharedArray(a):
+    """copy of array a in new shared memory, returns the shared memory and the array"""
+    shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+    shared = numpy.ndarray(a.shape, dtype=numpy.float64, buffer=shm.buf)
+    shared[:] = a
+    return shm, shared
+
+
+def getSamplePointsPool(points, sarray, minx, miny, pixsize, coordoffset, minz, processes):
+    """samples points in tiles by worker processes, attached to the image and points through shared memory"""
+    # workers import the module standalone, importing it from the cam package would need bpy
+    worker_path = os.path.join(os.path.dirname(__file__), 'workers')
+    if worker_path not in sys.path:
+        sys.path.append(worker_path)
+    import camSampling as worker
+
+    n = len(points)
+    tiles = [(start, min(start + SAMPLING_TILE_POINTS, n)) for start in range(0, n, SAMPLING_TILE_POINTS)]
+    shms = []
+    try:
+        image_shm, image = sharedArray(sarray)
+        shms.append(image_shm)
+        points_shm, points = sharedArray(points)
+        shms.append(points_shm)
+        samples_shm, samples = sharedArray(numpy.zeros(n))
+        shms.append(samples_shm)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=worker.init_worker,
+                                 initargs=(image_shm.name, image.shape, points_shm.name, samples_shm.name, n,
+                                           minx, miny, pixsize, coordoffset, minz)) as executor:
+            list(executor.map(worker.sample_tile, tiles))
+        result = samples.copy()
+        del image, points, samples
+        return result
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+def getSamplePointsParallel(points, sarray, minx, miny, pixsize, coordoffset, minz):
+    """samples many points in worker processes, few points in this process"""
+    processes = min(os.cpu_count() or 1, ceil(len(points) / SAMPLING_TILE_POINTS))
+    if len(points) >= SAMPLING_POOL_MIN_POINTS and processes > 1:
+        try:
+            return getSamplePointsPool(points, sarray, minx, miny, pixsize, coordoffset, minz, processes)
+        except (OSError, ImportError, BrokenProcessPool) as e:
+            print('sampling worker processes failed, sampling here', e)
+    return getSamplePoints(points, sarray, minx, miny, pixsize, coordoffset, minz)
+
+
 def getResolution(o):
     sx = o.max.x - o.min.x
     sy = o.max.y - o.min.y
@@ -1058,10 +1202,11 @@ def renderSampleImage(o):
         # ###setup image name
         iname = getCachePath(o) + '_z.exr'
         if not o.update_zbufferimage_tag:
-            try:
-                i = bpy.data.images.load(iname)
-            except:
-                o.update_zbufferimage_tag = True
+            a = getCachedImage(o, '_z')
+            if a is not None and a.shape == (resx, resy):
+                o.zbuffer_image = a
+                return o.zbuffer_image
+            o.update_zbufferimage_tag = True
         if o.update_zbufferimage_tag:
             s = bpy.context.scene
 
@@ -1084,8 +1229,7 @@ def renderSampleImage(o):
             r.resolution_y = resy
 
             # resize operation image
-            o.offset_image.resize((resx, resy))
-            o.offset_image.fill(-10)
+            o.offset_image = numpy.full((resx, resy), -10.0)
 
             # various settings for  faster render
             r.resolution_percentage = 100
@@ -1142,6 +1286,7 @@ def renderSampleImage(o):
             bpy.context.scene.render.engine = 'BLENDERCAM_RENDER'
         a = imagetonumpy(i)
         a = 1.0 - a
+        cacheImage(o, a, '_z')
         o.zbuffer_image = a
         o.update_zbufferimage_tag = False
 
@@ -1158,7 +1303,7 @@ def renderSampleImage(o):
             sy = 0
             ey = i.size[1]
 
-        o.offset_image.resize(ex - sx + 2 * o.borderwidth, ey - sy + 2 * o.borderwidth)
+        o.offset_image = numpy.full((ex - sx + 2 * o.borderwidth, ey - sy + 2 * o.borderwidth), -10.0)
 
         o.pixsize = o.source_image_size_x / i.size[0]
         simple.progress('pixel size in the image source', o.pixsize)
@@ -1212,18 +1357,16 @@ def prepareArea(o):
     renderSampleImage(o)
     samples = o.zbuffer_image
 
-    iname = simple.getCachePath(o) + '_off.exr'
-
     if not o.update_offsetimage_tag:
         progress('loading offset image')
-        try:
-            o.offset_image = imagetonumpy(bpy.data.images.load(iname))
-
-        except:
+        a = getCachedImage(o, '_off')
+        if a is not None and a.shape == samples.shape:
+            o.offset_image = a
+        else:
             o.update_offsetimage_tag = True
 
     if o.update_offsetimage_tag:
         if o.inverse:
             samples = numpy.maximum(samples, o.min.z - 0.00001)
         offsetArea(o, samples)
-        numpysave(o.offset_image, iname)
+        cacheImage(o, o.offset_image, '_off')
@@ -10,7 +10,59 @@ class Format:
         self.no_minus = no_minus
         self.round_down = round_down
 
+    def __setattr__(self, name, value):
+        # any change of settings invalidates the precomputed spec
+        self.__dict__[name] = value
+        if name != 'spec':
+            self.__dict__['spec'] = None
+
+    def get_spec(self):
+        dp = self.number_of_decimal_places
+        self.spec = (math.pow(10, dp), dp, self.add_leading_zeros, self.add_trailing_zeros, self.dp_wanted,
+                     self.add_plus, self.no_minus, self.string_generic(0))
+        return self.spec
+
     def string(self, number):
+        if number == None:
+            return 'None'
+        if self.round_down:
+            return self.string_generic(number)
+        scale, dp, leading, trailing, dp_wanted, add_plus, no_minus, zero = self.spec or self.get_spec()
+
+        n = float(number)
+        f = n * scale
+        if f < 0: f = f - .5
+        else: f = f + .5
+        if math.fabs(f) < 1.0:
+            return zero
+
+        s = '%f' % n
+        dot = len(s) - 7
+        if dot < 0 or s[dot] != '.':
+            return self.string_generic(number)  # inf, nan
+
+        minus = s[0] == '-'
+        if minus and no_minus:
+            before_dp = s[1:dot]
+        else:
+            before_dp = s[:dot]
+        if leading > 1:
+            before_dp = before_dp.zfill(leading)
+        after_dp = s[dot + 1: dot + 1 + dp]
+        if trailing:
+            after_dp = after_dp.ljust(dp, '0')
+        else:
+            after_dp = after_dp.rstrip('0')
+
+        if add_plus and not minus:
+            before_dp = '+' + before_dp
+        if after_dp:
+            if dp_wanted:
+                return before_dp + '.' + after_dp
+            return before_dp + after_dp
+        return before_dp
+
+    def string_generic(self, number):
         if number == None:
             return 'None'
         f = float(number) * math.pow(10, self.number_of_decimal_places)
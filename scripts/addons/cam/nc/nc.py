@@ -29,26 +29,36 @@ class Creator:
 	############################################################################
 	##	Internals
 
+	buffer_size = 1 << 16 # number of characters collected before they are written to the file
+
 	def file_open(self, name):
-		#self.buffer=[]
+		self.buffer = []
+		self.buffer_length = 0
 		self.file = open(name, 'w')
 		self.filename = name
 
 	def file_close(self):
-		#self.file.write(''.join(self.buffer))
-		#self.buffer=[]
+		self.file_flush()
 		self.file.close()
 
+	def file_flush(self):
+		if self.buffer:
+			self.file.write(''.join(self.buffer))
+			self.buffer = []
+			self.buffer_length = 0
+
 	def write(self, s):
-		self.file.write(s)
-		#self.buffer.append(s)
-		#if len(self.buffer)>100000:
-		#	self.file.write(''.join(self.buffer))
-		#	self.buffer=[]
+		self.buffer.append(s)
+		self.buffer_length += len(s)
+		if self.buffer_length > self.buffer_size:
+			self.file_flush()
 
 	def writem(self, a):
-		self.file.write(''.join(a))
-		#self.buffer.extend(a)
+		self.buffer.extend(a)
+		self.buffer_length += sum(map(len, a))
+		if self.buffer_length > self.buffer_size:
+			self.file_flush()
+
 	############################################################################
 	##	Programs
 
@@ -7,33 +7,83 @@ except ImportError:
     except ImportError:
         pass
 import tempfile
+import hashlib
+from collections import OrderedDict
 
-from io_mesh_stl import blender_utils
+import bpy
 import mathutils
 import math
+import numpy
 from cam.simple import activate
 from cam.exception import *
+from cam.workers.oclWaterline import get_STLSurf
 
 OCL_SCALE = 1000.0
 
-def get_oclSTL(operation):
-    me = None
-    oclSTL = ocl.STLSurf()
-    found_mesh=False
+OCL_STL_CACHE_SIZE = 2
+_oclSTL_cache = OrderedDict()
+
+
+def get_triangles(ob, use_modifiers):
+    """world space triangles of an object as numpy array of shape (n, 3, 3)"""
+    if ob.mode == 'EDIT':
+        ob.update_from_editmode()
+    if use_modifiers:
+        mesh_owner = ob.evaluated_get(bpy.context.evaluated_depsgraph_get())
+    else:
+        mesh_owner = ob
+    try:
+        mesh = mesh_owner.to_mesh()
+    except RuntimeError:
+        return numpy.empty((0, 3, 3))
+    if mesh is None:
+        return numpy.empty((0, 3, 3))
+    mesh.calc_loop_triangles()
+    co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get('co', co)
+    tris = numpy.empty(len(mesh.loop_triangles) * 3, dtype=numpy.int32)
+    mesh.loop_triangles.foreach_get('vertices', tris)
+    mesh_owner.to_mesh_clear()
+
+    mat = numpy.array(ob.matrix_world, dtype=numpy.float64)
+    co = co.reshape(-1, 3) @ mat[:3, :3].T + mat[:3, 3]
+    tris = tris.reshape(-1, 3)
+    if numpy.linalg.det(mat[:3, :3]) < 0:  # keep the winding for mirrored objects
+        tris = tris[:, ::-1]
+    return co[tris]
+
+
+def get_oclTriangles(operation):
+    """triangles of the operation objects in OCL units, with skin, as numpy array of shape (n, 3, 3)"""
+    triangles = []
+    found_mesh = False
     for collision_object in operation.objects:
         activate(collision_object)
         if collision_object.type == "MESH" or collision_object.type== "CURVE" or collision_object.type== "FONT" or collision_object.type== "SURFACE":
-            found_mesh=True
-            global_matrix = mathutils.Matrix.Identity(4)
-            faces = blender_utils.faces_from_mesh(collision_object, global_matrix, operation.use_modifiers)
-            for face in faces:
-                t = ocl.Triangle(ocl.Point(face[0][0]*OCL_SCALE, face[0][1]*OCL_SCALE, (face[0][2]+operation.skin)*OCL_SCALE),
-                        ocl.Point(face[1][0]*OCL_SCALE, face[1][1]*OCL_SCALE, (face[1][2]+operation.skin)*OCL_SCALE),
-                        ocl.Point(face[2][0]*OCL_SCALE, face[2][1]*OCL_SCALE, (face[2][2]+operation.skin)*OCL_SCALE))
-                oclSTL.addTriangle(t)
+            found_mesh = True
+            triangles.append(get_triangles(collision_object, operation.use_modifiers))
         # FIXME needs to work with collections
     if not found_mesh:
         raise CamException("This operation requires a mesh or curve object or equivalent (e.g. text, volume).")
+    triangles = numpy.concatenate(triangles)
+    triangles[:, :, 2] += operation.skin
+    triangles *= OCL_SCALE
+    return triangles
+
+
+def get_oclSTL(operation, triangles=None):
+    """STLSurf of the operation objects, reused while the evaluated meshes and skin don't change"""
+    if triangles is None:
+        triangles = get_oclTriangles(operation)
+    key = hashlib.sha1(triangles.tobytes()).hexdigest()
+    if key in _oclSTL_cache:
+        _oclSTL_cache.move_to_end(key)
+        return _oclSTL_cache[key]
+
+    oclSTL = get_STLSurf(triangles)
+    _oclSTL_cache[key] = oclSTL
+    while len(_oclSTL_cache) > OCL_STL_CACHE_SIZE:
+        _oclSTL_cache.popitem(last=False)
     return oclSTL
 
 
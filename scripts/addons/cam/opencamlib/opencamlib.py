@@ -9,14 +9,21 @@ except ImportError:
     except ImportError:
         pass
 import os
+import sys
 import tempfile
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from subprocess import call
+import numpy
 from cam.collision import BULLET_SCALE
 from cam import simple
 from cam.chunk import camPathChunk
 from cam.simple import *
 from shapely import geometry as sgeometry
-from .oclSample import get_oclSTL
+from .oclSample import get_oclSTL, get_oclTriangles
+from cam.workers.oclWaterline import get_waterline, waterline_loops
 
 from cam.opencamlib.oclSample import ocl_sample
 
@@ -103,8 +110,9 @@ def oclResampleChunks(operation, chunks_to_resample):
         for p_index in range(i_start, i_start + i_length):
             z = samples[sample_index].z / OCL_SCALE
             sample_index += 1
-            if z > chunk.points[p_index][2]:
-                chunk.points[p_index][2] = z
+            p = chunk.points[p_index]
+            if z > p[2]:
+                chunk.points[p_index] = (p[0], p[1], z)
 
 
 def oclWaterlineLayerHeights(operation):
@@ -127,9 +135,31 @@ def oclGetMedialAxis(operation, chunks):
     waterlineChunksFromOCL(operation, chunks)
 
 
+def oclWaterlinePool(triangles, cutter, sampling, heights, processes):
+    """computes waterline layers in worker processes, which build the surface from shared triangles"""
+    # workers import the module standalone, importing it from the cam package would need bpy
+    worker_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'workers')
+    if worker_path not in sys.path:
+        sys.path.append(worker_path)
+    import oclWaterline as worker
+
+    shm = shared_memory.SharedMemory(create=True, size=triangles.nbytes)
+    try:
+        shared = numpy.ndarray(triangles.shape, dtype=numpy.float64, buffer=shm.buf)
+        shared[:] = triangles
+        del shared
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=worker.init_worker,
+                                 initargs=(shm.name, triangles.shape, cutter, sampling)) as executor:
+            return list(executor.map(worker.worker_loops, heights))
+    finally:
+        shm.close()
+        shm.unlink()
+
+
 def oclGetWaterline(operation, chunks):
     layers = oclWaterlineLayerHeights(operation)
-    oclSTL = get_oclSTL(operation)
+    triangles = get_oclTriangles(operation)
 
     op_cutter_type = operation.cutter_type
     op_cutter_diameter = operation.cutter_diameter
@@ -140,31 +170,37 @@ def oclGetWaterline(operation, chunks):
     cutter = None
     cutter_length = 150 #TODO: automatically determine necessary cutter length depending on object size
 
+    # cutters are passed by ocl class name and arguments, so worker processes can create them
     if op_cutter_type == 'END':
-        cutter = ocl.CylCutter((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length)
+        cutter = ('CylCutter', ((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length))
     elif op_cutter_type == 'BALLNOSE':
-        cutter = ocl.BallCutter((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length)
+        cutter = ('BallCutter', ((op_cutter_diameter + operation.skin * 2) * 1000, cutter_length))
     elif op_cutter_type == 'VCARVE':
-        cutter = ocl.ConeCutter((op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle, cutter_length)
+        cutter = ('ConeCutter', ((op_cutter_diameter + operation.skin * 2) * 1000, op_cutter_tip_angle, cutter_length))
     else:
         print("Cutter unsupported: {0}\n".format(op_cutter_type))
         quit()
 
-
-    waterline = ocl.Waterline()
-    waterline.setSTL(oclSTL)
-    waterline.setCutter(cutter)
-    waterline.setSampling(0.1)#TODO: add sampling setting to UI
-    for height in layers:
+    sampling = operation.waterline_sampling * OCL_SCALE
+    heights = [height * OCL_SCALE for height in layers]
+    processes = min(len(heights), os.cpu_count() or 1)
+    layer_loops = None
+    if processes > 1:
+        try:
+            layer_loops = oclWaterlinePool(triangles, cutter, sampling, heights, processes)
+        except (OSError, ImportError, BrokenProcessPool) as e:
+            print('waterline worker processes failed, computing layers here', e)
+    if layer_loops is None:
+        waterline = get_waterline(get_oclSTL(operation, triangles), cutter, sampling)
+        layer_loops = [waterline_loops(waterline, height) for height in heights]
+
+    # layers and loops in the order of heights, same as computed one by one
+    for height, wl_loops in zip(layers, layer_loops):
         print(str(height) + '\n')
-        waterline.reset()
-        waterline.setZ(height * OCL_SCALE)
-        waterline.run2()
-        wl_loops = waterline.getLoops()
         for l in wl_loops:
             chunks.append(camPathChunk(inpoints=[]))
             for p in l:
-                chunks[-1].points.append((p.x / OCL_SCALE, p.y / OCL_SCALE, p.z / OCL_SCALE))
+                chunks[-1].points.append((p[0] / OCL_SCALE, p[1] / OCL_SCALE, p[2] / OCL_SCALE))
             chunks[-1].append(chunks[-1].points[0])
             chunks[-1].closed = True
             chunks[-1].poly = sgeometry.Polygon(chunks[-1].points)
@@ -332,20 +332,19 @@ def getPathPattern(operation):
         approxn = (min(maxx - minx, maxy - miny) / o.dist_between_paths) / 2
         i = 0
 
+        tolerance = 0
+        if o.optimize:
+            tolerance = o.optimize_threshold * 0.000001
         for porig in polys:
-            p = porig
-            while not p.is_empty:
-                p = p.buffer(-o.dist_between_paths, o.circle_detail)
-                if not p.is_empty:
-
-                    nchunks = shapelyToChunks(p, zlevel)
-
-                    if o.movement_insideout == 'INSIDEOUT':
-                        parentChildDist(lastchunks, nchunks, o)
-                    else:
-                        parentChildDist(nchunks, lastchunks, o)
-                    pathchunks.extend(nchunks)
-                    lastchunks = nchunks
+            for p in polygon_utils_cam.offsetRings(porig, -o.dist_between_paths, o.circle_detail, tolerance):
+                nchunks = shapelyToChunks(p, zlevel)
+
+                if o.movement_insideout == 'INSIDEOUT':
+                    parentChildDist(lastchunks, nchunks, o)
+                else:
+                    parentChildDist(nchunks, lastchunks, o)
+                pathchunks.extend(nchunks)
+                lastchunks = nchunks
                 percent = int(i / approxn * 100)
                 progress('outlining polygons ', percent)
                 i += 1
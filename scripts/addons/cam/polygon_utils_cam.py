@@ -22,10 +22,18 @@
 import math
 import mathutils
 import curve_simplify
+import numpy
 
 import shapely
 from shapely.geometry import polygon as spolygon
 from shapely import geometry as sgeometry
+from shapely import prepared
+import shapely.ops
+from shapely.strtree import STRtree
+try:
+    from scipy.spatial import Voronoi
+except ImportError:
+    Voronoi = None
 
 SHAPELY = True
 
@@ -63,6 +71,19 @@ def shapelyRemoveDoubles(p, optimize_threshold):
     return pnew
 
 
+def offsetRings(p, distance, circle_detail, tolerance=0):
+    """successive offsets of polygon p, each one computed from the previous ring.
+    rings are simplified within tolerance, so their point count doesn't grow with every step.
+    stops when the offset gets empty"""
+    while True:
+        p = p.buffer(distance, circle_detail)
+        if p.is_empty:
+            return
+        if tolerance > 0:
+            p = p.simplify(tolerance)
+        yield p
+
+
 def shapelyToMultipolygon(anydata):
     if anydata.type == 'MultiPolygon':
         return anydata
@@ -160,3 +181,154 @@ def shapelyToCurve(name, p, z):
         c.use_cyclic_u = True
 
     return objectdata  # bpy.context.active_object
+
+
+class PolygonMask:
+    """polygon rasterized to a boolean pixel mask, for fast point in polygon tests of many points.
+    pixels touched by the polygon boundary are marked uncertain, points in them are tested on the exact geometry."""
+
+    def __init__(self, p, pixsize):
+        self.poly = p
+        self.prepared = prepared.prep(p)
+        self.pixsize = pixsize
+        self.inside = None
+        self.uncertain = None
+        if p.is_empty or p.geom_type not in ('Polygon', 'MultiPolygon'):
+            return  # no mask, everything goes to the exact test
+
+        minx, miny, maxx, maxy = p.bounds
+        self.minx = minx - pixsize
+        self.miny = miny - pixsize
+        resx = int(math.ceil((maxx - minx) / pixsize)) + 2
+        resy = int(math.ceil((maxy - miny) / pixsize)) + 2
+
+        edges = []
+        for ring in shapelyToCoords(p):
+            c = numpy.array(ring, dtype=float)[:, :2]
+            if len(c) > 1:
+                edges.append(numpy.hstack((c[:-1], c[1:])))
+        edges = numpy.vstack(edges)
+        x1, y1, x2, y2 = edges.T
+
+        # even-odd fill, evaluated in pixel centers. every edge crossing of a row toggles all pixels right of it.
+        rows = self.miny + (numpy.arange(resy) + 0.5) * pixsize
+        toggles = numpy.zeros((resy, resx + 1), dtype=numpy.int32)
+        ylo = numpy.minimum(y1, y2)
+        yhi = numpy.maximum(y1, y2)
+        first = numpy.searchsorted(rows, ylo, side='left')
+        last = numpy.searchsorted(rows, yhi, side='left')
+        counts = last - first
+        ei = numpy.repeat(numpy.arange(len(edges)), counts)
+        ri = numpy.repeat(first - numpy.cumsum(counts) + counts, counts) + numpy.arange(counts.sum())
+        ratio = (rows[ri] - y1[ei]) / (y2[ei] - y1[ei])
+        xc = x1[ei] + (x2[ei] - x1[ei]) * ratio
+        ci = numpy.clip(numpy.floor((xc - self.minx) / pixsize - 0.5).astype(int) + 1, 0, resx)
+        numpy.add.at(toggles, (ri, ci), 1)
+        self.inside = (numpy.cumsum(toggles[:, :resx], axis=1) % 2 == 1).T
+
+        # boundary pixels, edges are walked with half pixel steps and the hit pixels grown by one.
+        lengths = numpy.hypot(x2 - x1, y2 - y1)
+        steps = numpy.ceil(lengths / (pixsize * 0.5)).astype(int) + 1
+        ei = numpy.repeat(numpy.arange(len(edges)), steps)
+        t = (numpy.arange(steps.sum()) - numpy.repeat(numpy.cumsum(steps) - steps, steps)) / numpy.repeat(
+            numpy.maximum(steps - 1, 1), steps)
+        bx = numpy.floor((x1[ei] + (x2[ei] - x1[ei]) * t - self.minx) / pixsize).astype(int)
+        by = numpy.floor((y1[ei] + (y2[ei] - y1[ei]) * t - self.miny) / pixsize).astype(int)
+        uncertain = numpy.zeros((resx + 2, resy + 2), dtype=bool)
+        for dx in (0, 1, 2):
+            for dy in (0, 1, 2):
+                uncertain[numpy.clip(bx + dx, 0, resx + 1), numpy.clip(by + dy, 0, resy + 1)] = True
+        self.uncertain = uncertain[1:-1, 1:-1]
+
+    def containsPoints(self, xs, ys):
+        """same result as p.contains(Point(x, y)) for arrays of points"""
+        xs = numpy.asarray(xs, dtype=float)
+        ys = numpy.asarray(ys, dtype=float)
+        result = numpy.zeros(xs.shape, dtype=bool)
+        if self.inside is None:
+            check = numpy.ones(xs.shape, dtype=bool)
+        else:
+            ix = numpy.floor((xs - self.minx) / self.pixsize).astype(int)
+            iy = numpy.floor((ys - self.miny) / self.pixsize).astype(int)
+            ingrid = (ix >= 0) & (ix < self.inside.shape[0]) & (iy >= 0) & (iy < self.inside.shape[1])
+            ix = ix[ingrid]
+            iy = iy[ingrid]
+            result[ingrid] = self.inside[ix, iy]
+            check = numpy.zeros(xs.shape, dtype=bool)
+            check[ingrid] = self.uncertain[ix, iy]
+        for i in numpy.nonzero(check)[0]:
+            result[i] = self.prepared.contains(sgeometry.Point(xs[i], ys[i]))
+        return result
+
+    def contains(self, x, y):
+        return bool(self.containsPoints([x], [y])[0])
+
+
+def getAmbientMask(o):
+    """rasterized ambient of the operation, rebuilt only when the ambient polygon or pixsize changes"""
+    mask = o.ambient_mask
+    if mask is None or mask.poly is not o.ambient or mask.pixsize != o.pixsize:
+        mask = PolygonMask(o.ambient, o.pixsize)
+        o.ambient_mask = mask
+    return mask
+
+
+def containsPoints(p, xs, ys):
+    """same result as p.contains(Point(x, y)) for arrays of points, tested on the prepared polygon"""
+    xs = numpy.asarray(xs, dtype=float)
+    ys = numpy.asarray(ys, dtype=float)
+    if hasattr(shapely, 'contains_xy'):  # shapely >= 2.0 tests all points at once
+        shapely.prepare(p)
+        return shapely.contains_xy(p, xs, ys)
+    pp = prepared.prep(p)
+    return numpy.array([pp.contains(sgeometry.Point(x, y)) for x, y in zip(xs.tolist(), ys.tolist())], dtype=bool)
+
+
+def distancePoints(p, xs, ys):
+    """distances of arrays of points from geometry p"""
+    xs = numpy.asarray(xs, dtype=float)
+    ys = numpy.asarray(ys, dtype=float)
+    if hasattr(shapely, 'distance'):  # shapely >= 2.0
+        return shapely.distance(p, shapely.points(xs, ys))
+    return numpy.array([p.distance(sgeometry.Point(x, y)) for x, y in zip(xs.tolist(), ys.tolist())])
+
+
+def getVoronoiEdges(points):
+    """finite edges of the voronoi diagram of points (n, 2), computed by Qhull from scipy when it's there,
+    otherwise by GEOS. returns unique vertices (m, 2) and edges as pairs of vertex indices (k, 2)"""
+    points = numpy.asarray(points, dtype=float)[:, :2]
+    if Voronoi is not None:
+        diagram = Voronoi(points)
+        edges = numpy.array(diagram.ridge_vertices, dtype=int).reshape(-1, 2)
+        return diagram.vertices, edges[numpy.all(edges >= 0, axis=1)]
+
+    diagram = shapely.ops.voronoi_diagram(sgeometry.MultiPoint(points), edges=True)
+    lines = []
+    for g in getattr(diagram, 'geoms', [diagram]):
+        lines.extend(getattr(g, 'geoms', [g]))
+    segments = []
+    for line in lines:
+        c = numpy.asarray(line.coords)[:, :2]
+        if len(c) > 1:
+            segments.append(numpy.stack((c[:-1], c[1:]), axis=1))
+    if len(segments) == 0:
+        return numpy.zeros((0, 2)), numpy.zeros((0, 2), dtype=int)
+    segments = numpy.concatenate(segments)
+    vertices, edges = numpy.unique(segments.reshape(-1, 2), axis=0, return_inverse=True)
+    return vertices, edges.reshape(-1, 2)
+
+
+def getBoxTree(boxes):
+    """STRtree over bounding boxes (minx, miny, maxx, maxy).
+    returns a query function giving sorted indices of the boxes touching a box."""
+    geoms = [sgeometry.box(*b) for b in boxes]
+    tree = STRtree(geoms)
+    lookup = {id(g): i for i, g in enumerate(geoms)}
+
+    def query(box):
+        found = tree.query(sgeometry.box(*box))
+        if len(found) > 0 and isinstance(found[0], sgeometry.base.BaseGeometry):  # shapely < 2.0 gives geometries
+            return sorted(lookup[id(g)] for g in found)
+        return sorted(int(i) for i in found)
+
+    return query
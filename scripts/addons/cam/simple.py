@@ -24,6 +24,8 @@ import sys
 import os
 import string
 import time
+import hashlib
+import numpy
 import bpy
 import mathutils
 from mathutils import *
@@ -171,6 +173,44 @@ def getCachePath(o):
     return iname
 
 
+def hashValues(*values):
+    """short content hash of plain values (numbers, strings, tuples of them)"""
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
+def hashObjects(obs, use_modifiers=True):
+    """content hash of object geometry - vertex coordinates, faces and transforms.
+    catches mesh edits that keep the object dimensions."""
+    h = hashlib.sha1()
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    for ob in obs:
+        h.update(ob.name.encode())
+        h.update(numpy.array(ob.matrix_world, dtype=numpy.float64).tobytes())
+        if use_modifiers:
+            ob = ob.evaluated_get(depsgraph)
+        try:
+            mesh = ob.to_mesh()
+        except RuntimeError:  # objects without geometry
+            continue
+        if mesh is None:
+            continue
+        co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get('co', co)
+        h.update(co.tobytes())
+        faces = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+        mesh.loops.foreach_get('vertex_index', faces)
+        h.update(faces.tobytes())
+        ob.to_mesh_clear()
+    return h.hexdigest()
+
+
+def hashImage(i):
+    """content hash of blender image pixels"""
+    pixels = numpy.empty(len(i.pixels), dtype=numpy.float32)
+    i.pixels.foreach_get(pixels)
+    return hashlib.sha1(pixels.tobytes()).hexdigest()
+
+
 def getSimulationPath():
     fn = bpy.data.filepath
     l = len(bpy.path.basename(fn))
@@ -25,12 +25,14 @@ import bpy
 import mathutils
 import math
 import time
+from collections import OrderedDict
 from bpy.props import *
 from cam import utils
 import numpy as np
 
 from cam import simple
 from cam import image_utils
+from cam.simulation_load import getSimulationLoadGraph, smoothSimulationLoads
 
 
 def createSimulationObject(name, operations, i):
@@ -141,140 +143,49 @@ def generateSimulationImage(operations, limits):
             else:
                 shapek = m.shape_keys.key_blocks[kname]
             shapek.data[0].co = (0.0, 0, 0)
-        # print(len(shapek.data))
-        # print(len(verts_rotations))
-
-        # print(r)
-
-        totalvolume = 0.0
 
         cutterArray = getCutterArray(o, simulation_detail)
         cutterArray = -cutterArray
-        lasts = verts[1].co
+        simple.progress('simulation', 0)
+        co = np.empty(len(verts) * 3, dtype=np.float32)
+        verts.foreach_get('co', co)
+        co = co.reshape(-1, 3)
+        xs, ys, zs, stampverts = getSimulationStamps(co, maxz, minx, miny, simulation_detail, borderwidth)
+        if not o.do_simulation_feedrate:
+            # without volumes the stamps don't need to be measured one by one.
+            simCutterStamps(xs, ys, zs, cutterArray, si)
+            continue
+
+        # the volume each stamp takes away depends on the stamps before it.
+        volumes = np.zeros(len(zs))
         perc = -1
-        vtotal = len(verts)
-        dropped = 0
-
-        xs = 0
-        ys = 0
-
-        for i, vert in enumerate(verts):
+        vtotal = len(zs)
+        for i, (x, y, z) in enumerate(zip(xs.tolist(), ys.tolist(), zs.tolist())):
             if perc != int(100 * i / vtotal):
                 perc = int(100 * i / vtotal)
                 simple.progress('simulation', perc)
-            # progress('simulation ',int(100*i/l))
-
-            if i > 0:
-                volume = 0
-                volume_partial = 0
-                s = vert.co
-                v = s - lasts
-
-                l = v.length
-                if (lasts.z < maxz or s.z < maxz) and not (
-                        v.x == 0 and v.y == 0 and v.z > 0):  # only simulate inside material, and exclude lift-ups
-                    if (
-                            v.x == 0 and v.y == 0 and v.z < 0):
-                        # if the cutter goes straight down, we don't have to interpolate.
-                        pass
-
-                    elif v.length > simulation_detail:  # and not :
-
-                        v.length = simulation_detail
-                        lastxs = xs
-                        lastys = ys
-                        while v.length < l:
-                            xs = int((lasts.x + v.x - minx) / simulation_detail + borderwidth + simulation_detail / 2)
-                            # -middle
-                            ys = int((lasts.y + v.y - miny) / simulation_detail + borderwidth + simulation_detail / 2)
-                            # -middle
-                            z = lasts.z + v.z
-                            # print(z)
-                            if lastxs != xs or lastys != ys:
-                                volume_partial = simCutterSpot(xs, ys, z, cutterArray, si, o.do_simulation_feedrate)
-                                if o.do_simulation_feedrate:
-                                    totalvolume += volume
-                                    volume += volume_partial
-                                lastxs = xs
-                                lastys = ys
-                            else:
-                                dropped += 1
-                            v.length += simulation_detail
-
-                    xs = int((s.x - minx) / simulation_detail + borderwidth + simulation_detail / 2)  # -middle
-                    ys = int((s.y - miny) / simulation_detail + borderwidth + simulation_detail / 2)  # -middle
-                    volume_partial = simCutterSpot(xs, ys, s.z, cutterArray, si, o.do_simulation_feedrate)
-                if o.do_simulation_feedrate:  # compute volumes and write data into shapekey.
-                    volume += volume_partial
-                    totalvolume += volume
-                    if l > 0:
-                        load = volume / l
-                    else:
-                        load = 0
-
-                    # this will show the shapekey as debugging graph and will use same data to estimate parts
-                    # with heavy load
-                    if l != 0:
-                        shapek.data[i].co.y = (load) * 0.000002
-                    else:
-                        shapek.data[i].co.y = shapek.data[i - 1].co.y
-                    shapek.data[i].co.x = shapek.data[i - 1].co.x + l * 0.04
-                    shapek.data[i].co.z = 0
-                lasts = s
-
-        # print('dropped '+str(dropped))
-        if o.do_simulation_feedrate:  # smoothing ,but only backward!
-            xcoef = shapek.data[len(shapek.data) - 1].co.x / len(shapek.data)
-            for a in range(0, 10):
-                # print(shapek.data[-1].co)
-                nvals = []
-                val1 = 0  #
-                val2 = 0
-                w1 = 0  #
-                w2 = 0
-
-                for i, d in enumerate(shapek.data):
-                    val = d.co.y
-
-                    if i > 1:
-                        d1 = shapek.data[i - 1].co
-                        val1 = d1.y
-                        if d1.x - d.co.x != 0:
-                            w1 = 1 / (abs(d1.x - d.co.x) / xcoef)
-
-                    if i < len(shapek.data) - 1:
-                        d2 = shapek.data[i + 1].co
-                        val2 = d2.y
-                        if d2.x - d.co.x != 0:
-                            w2 = 1 / (abs(d2.x - d.co.x) / xcoef)
-
-                    # print(val,val1,val2,w1,w2)
-
-                    val = (val + val1 * w1 + val2 * w2) / (1.0 + w1 + w2)
-                    nvals.append(val)
-                for i, d in enumerate(shapek.data):
-                    d.co.y = nvals[i]
-
-            # apply mapping - convert the values to actual feedrates.
-            total_load = 0
-            max_load = 0
-            for i, d in enumerate(shapek.data):
-                total_load += d.co.y
-                max_load = max(max_load, d.co.y)
-            normal_load = total_load / len(shapek.data)
-
-            thres = 0.5
-
-            scale_graph = 0.05  # warning this has to be same as in export in utils!!!!
-
-            totverts = len(shapek.data)
-            for i, d in enumerate(shapek.data):
-                if d.co.y > normal_load:
-                    d.co.z = scale_graph * max(0.3, normal_load / d.co.y)
-                else:
-                    d.co.z = scale_graph * 1
-                if i < totverts - 1:
-                    m.edges[i].crease = d.co.y / (normal_load * 4)
+            volumes[i] = simCutterSpot(x, y, z, cutterArray, si, True)
+
+        # compute volumes and write data into shapekey.
+        # this will show the shapekey as debugging graph and will use same data to estimate parts
+        # with heavy load
+        graph = getSimulationLoadGraph(co, stampverts, volumes)
+        graph[:, 1] = smoothSimulationLoads(graph[:, 0], graph[:, 1])
+
+        # apply mapping - convert the values to actual feedrates.
+        loads = graph[:, 1]
+        normal_load = loads.sum() / len(loads)
+        scale_graph = 0.05  # warning this has to be same as in export in utils!!!!
+        with np.errstate(divide='ignore', invalid='ignore'):
+            graph[:, 2] = np.where(loads > normal_load, scale_graph * np.maximum(0.3, normal_load / loads), scale_graph)
+            creases = loads / (normal_load * 4)
+        shapek.data.foreach_set('co', graph.astype(np.float32).ravel())
+
+        edgecreases = np.empty(len(m.edges), dtype=np.float32)
+        m.edges.foreach_get('crease', edgecreases)
+        ncreases = min(len(m.edges), len(loads) - 1)
+        edgecreases[:ncreases] = np.nan_to_num(creases[:ncreases], posinf=0)
+        m.edges.foreach_set('crease', edgecreases)
 
     si = si[borderwidth:-borderwidth, borderwidth:-borderwidth]
     si += -minz
@@ -282,100 +193,136 @@ def generateSimulationImage(operations, limits):
     return si
 
 
+def getSimulationStamps(co, maxz, minx, miny, simulation_detail, borderwidth):
+    """pixel positions, heights and path vertex indices of all cutter stamps of a path with vertices co,
+    the same and in the same order as the step by step simulation loop produces them"""
+    if len(co) < 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0), np.zeros(0, dtype=int)
+    co = np.asarray(co, dtype=float)
+    # the loop starts with the second vertex, the first one is never stamped
+    prev = np.vstack((co[1:2], co[1:-1]))
+    cur = co[1:]
+    v = cur - prev
+    l = np.linalg.norm(v, axis=1)
+    lift = (v[:, 0] == 0) & (v[:, 1] == 0) & (v[:, 2] > 0)
+    down = (v[:, 0] == 0) & (v[:, 1] == 0) & (v[:, 2] < 0)
+    simulated = ((prev[:, 2] < maxz) | (cur[:, 2] < maxz)) & ~lift
+    interpolated = simulated & ~down & (l > simulation_detail)
+    # steps at simulation_detail distances, shorter than the segment
+    steps = np.floor(l / simulation_detail)
+    steps -= steps * simulation_detail >= l
+    steps = np.where(interpolated, steps, 0).astype(int)
+
+    counts = steps + simulated
+    seg = np.repeat(np.arange(len(cur)), counts)
+    k = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    final = k > steps[seg]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        direction = v / l[:, np.newaxis]
+    points = prev[seg] + direction[seg] * (k * simulation_detail)[:, np.newaxis]
+    points[final] = cur[seg[final]]
+
+    xs = ((points[:, 0] - minx) / simulation_detail + borderwidth + simulation_detail / 2).astype(int)
+    ys = ((points[:, 1] - miny) / simulation_detail + borderwidth + simulation_detail / 2).astype(int)
+    # interpolated steps landing on the pixel of the previous step are dropped
+    lastxs = np.concatenate(([0], xs[:-1]))
+    lastys = np.concatenate(([0], ys[:-1]))
+    keep = final | (xs != lastxs) | (ys != lastys)
+    return xs[keep], ys[keep], points[keep, 2], seg[keep] + 1
+
+
+def simCutterStamps(xs, ys, zs, cutterArray, si):
+    """stamps the cutter into stock at all the stamp positions, skipping the ones outside of the image"""
+    m = int(cutterArray.shape[0] / 2)
+    inside = (xs > -m) & (xs < si.shape[0] + m) & (ys > -m) & (ys < si.shape[1] + m)
+    for x, y, z in zip(xs[inside].tolist(), ys[inside].tolist(), zs[inside].tolist()):
+        simCutterSpot(x, y, z, cutterArray, si)
+
+
+CUSTOM_CUTTER_CACHE_SIZE = 4
+_custom_cutter_cache = OrderedDict()
+
+
+def getCustomCutterArray(cutob, r, res, pixsize):
+    """heights of a custom cutter object sampled by ray casting, reused while the object and resolution don't change"""
+    key = simple.hashObjects([cutob]) + simple.hashValues(r, res, pixsize)
+    if key in _custom_cutter_cache:
+        _custom_cutter_cache.move_to_end(key)
+        return _custom_cutter_cache[key].copy()
+
+    car = np.full((res, res), -10.0)
+    m = res / 2.0
+    ps = pixsize
+    scale = ((cutob.dimensions.x / cutob.scale.x) / 2) / r  #
+    vstart = mathutils.Vector((0, 0, -10))
+    vend = mathutils.Vector((0, 0, 10))
+    print('sampling custom cutter')
+    maxz = -1
+    for a in range(0, res):
+        vstart.x = (a + 0.5 - m) * ps * scale
+        vend.x = vstart.x
+
+        for b in range(0, res):
+            vstart.y = (b + 0.5 - m) * ps * scale
+            vend.y = vstart.y
+            v = vend - vstart
+            c = cutob.ray_cast(vstart, v, distance=1.70141e+38)
+            if c[3] != -1:
+                z = -c[1][2] / scale
+                if z > -9:
+                    if z > maxz:
+                        maxz = z
+                    car[a, b] = z
+    car -= maxz
+
+    _custom_cutter_cache[key] = car
+    while len(_custom_cutter_cache) > CUSTOM_CUTTER_CACHE_SIZE:
+        _custom_cutter_cache.popitem(last=False)
+    return car.copy()
+
+
 def getCutterArray(operation, pixsize):
     type = operation.cutter_type
     # print('generating cutter')
     r = operation.cutter_diameter / 2 + operation.skin  # /operation.pixsize
     res = math.ceil((r * 2) / pixsize)
     m = res / 2.0
-    car = np.array((0), dtype=float)
-    car.resize(res, res)
-    car.fill(-10)
+    car = np.full((res, res), -10.0)
 
-    v = mathutils.Vector((0, 0, 0))
+    # distance of pixel centers from the cutter axis
     ps = pixsize
+    c = (np.arange(res) + 0.5 - m) * ps
+    dist = np.hypot(c[:, np.newaxis], c[np.newaxis, :])
+    inside = dist <= r
+    d = dist[inside]
     if type == 'END':
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= r:
-                    car.itemset((a, b), 0)
+        car[inside] = 0
     elif type == 'BALL' or type == 'BALLNOSE':
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= r:
-                    z = math.sin(math.acos(v.length / r)) * r - r
-                    car.itemset((a, b), z)  # [a,b]=z
+        car[inside] = np.sin(np.arccos(d / r)) * r - r
 
     elif type == 'VCARVE':
         angle = operation.cutter_tip_angle
         s = math.tan(math.pi * (90 - angle / 2) / 180)  # angle in degrees
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= r:
-                    z = (-v.length * s)
-                    car.itemset((a, b), z)
+        car[inside] = -d * s
     elif type == 'CYLCONE':
         angle = operation.cutter_tip_angle
         cyl_r = operation.cylcone_diameter/2
         s = math.tan(math.pi * (90 - angle / 2) / 180)  # angle in degrees
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= r:
-                    z = (-(v.length - cyl_r) * s)
-                    if v.length <= cyl_r:
-                        z = 0
-                    car.itemset((a, b), z)
+        car[inside] = np.where(d <= cyl_r, 0, -(d - cyl_r) * s)
     elif type == 'BALLCONE':
         angle = math.radians(operation.cutter_tip_angle)/2
         ball_r = operation.ball_radius
         cutter_r = operation.cutter_diameter / 2
-        conedepth = (cutter_r - ball_r)/math.tan(angle)
         Ball_R = ball_r/math.cos(angle)
         D_ofset = ball_r * math.tan(angle)
         s = math.tan(math.pi/2-angle)
-        for a in range(0, res):
-            v.x = (a + 0.5 - m) * ps
-            for b in range(0, res):
-                v.y = (b + 0.5 - m) * ps
-                if v.length <= cutter_r:
-                    z = -(v.length - ball_r) * s - Ball_R + D_ofset
-                    if v.length <= ball_r:
-                        z = math.sin(math.acos(v.length / Ball_R)) * Ball_R - Ball_R
-                    car.itemset((a, b), z)
+        inside = dist <= cutter_r
+        d = dist[inside]
+        ball = np.sin(np.arccos(np.minimum(d / Ball_R, 1))) * Ball_R - Ball_R
+        car[inside] = np.where(d <= ball_r, ball, -(d - ball_r) * s - Ball_R + D_ofset)
     elif type == 'CUSTOM':
         cutob = bpy.data.objects[operation.cutter_object_name]
-        scale = ((cutob.dimensions.x / cutob.scale.x) / 2) / r  #
-        # print(cutob.scale)
-        vstart = mathutils.Vector((0, 0, -10))
-        vend = mathutils.Vector((0, 0, 10))
-        print('sampling custom cutter')
-        maxz = -1
-        for a in range(0, res):
-            vstart.x = (a + 0.5 - m) * ps * scale
-            vend.x = vstart.x
-
-            for b in range(0, res):
-                vstart.y = (b + 0.5 - m) * ps * scale
-                vend.y = vstart.y
-                v = vend - vstart
-                c = cutob.ray_cast(vstart, v, distance=1.70141e+38)
-                if c[3] != -1:
-                    z = -c[1][2] / scale
-                    # print(c)
-                    if z > -9:
-                        # print(z)
-                        if z > maxz:
-                            maxz = z
-                        car.itemset((a, b), z)
-        car -= maxz
+        car = getCustomCutterArray(cutob, r, res, pixsize)
     return car
 
 
@@ -401,7 +348,7 @@ def simCutterSpot(xs, ys, z, cutterArray, si, getvolume=False):
         startx = max(0, xs - m)
         starty = max(0, ys - m)
         endx = min(si.shape[0], xs - m + size)
-        endy = min(si.shape[0], ys - m + size)
+        endy = min(si.shape[1], ys - m + size)
         castartx = max(0, m - xs)
         castarty = max(0, m - ys)
         caendx = min(size, si.shape[0] - xs + m)
@@ -0,0 +1,44 @@
+# feedrate load graph of the simulation
+# this module doesn't import bpy, so it can be checked outside of blender, see testing_simulation.py
+
+import numpy as np
+
+
+def getSimulationLoadGraph(co, stampverts, volumes):
+    """feedrate graph of a path, x is the path length, y the volume taken away per unit of length"""
+    graph = np.zeros((len(co), 3))
+    if len(co) < 2:
+        return graph
+    co = np.asarray(co, dtype=float)
+    l = np.linalg.norm(co[1:] - co[:-1], axis=1)
+    # the simulation starts at the second vertex, so it has no move and no load
+    l[0] = 0
+    volume = np.bincount(stampverts, weights=volumes, minlength=len(co))[1:]
+    load = np.divide(volume, l, out=np.zeros(len(l)), where=l > 0) * 0.000002
+    # zero length moves keep the load of the previous vertex
+    lasti = np.maximum.accumulate(np.where(l != 0, np.arange(1, len(co)), 0))
+    graph[1:, 1] = np.concatenate(([0], load))[lasti]
+    graph[1:, 0] = np.cumsum(l * 0.04)
+    return graph
+
+
+def smoothSimulationLoads(x, y, passes=10):
+    """smoothing of the load graph with neighbours weighted by inverse distance"""
+    n = len(y)
+    if n < 2:
+        return y
+    xcoef = x[-1] / n
+    i = np.arange(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dx1 = np.abs(np.concatenate(([0, 0], x[1:-1] - x[2:])))
+        dx2 = np.abs(np.concatenate((x[1:] - x[:-1], [0])))
+        w1 = 1 / (dx1 / xcoef)
+        w2 = 1 / (dx2 / xcoef)
+    # a weight is only updated for neighbours at a distance, otherwise the last one is used again
+    w1 = np.concatenate(([0], w1))[np.maximum.accumulate(np.where(dx1 != 0, i + 1, 0))]
+    w2 = np.concatenate(([0], w2))[np.maximum.accumulate(np.where(dx2 != 0, i + 1, 0))]
+    for a in range(0, passes):
+        y1 = np.concatenate(([0, 0], y[1:-1]))
+        y2 = np.concatenate((y[1:], y[-1:]))
+        y = (y + y1 * w1 + y2 * w2) / (1.0 + w1 + w2)
+    return y
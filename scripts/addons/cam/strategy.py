@@ -26,6 +26,7 @@ from bpy.props import *
 import time
 import math
 from math import *
+import numpy
 from bpy_extras import object_utils
 from cam import chunk
 from cam.chunk import *
@@ -323,14 +324,15 @@ def pocket(o):
     centers = None
     firstoutline = p  # for testing in the end.
     prest = p.buffer(-c_offset, o.circle_detail)
+    tolerance = 0
+    if o.optimize:
+        tolerance = o.optimize_threshold * 0.000001
+    rings = polygon_utils_cam.offsetRings(p, -o.dist_between_paths, o.circle_detail, tolerance)
     while not p.is_empty:
         if o.pocketToCurve:
             polygon_utils_cam.shapelyToCurve('3dpocket', p, 0.0)  # make a curve starting with _3dpocket
 
         nchunks = shapelyToChunks(p, o.min.z)
-        # print("nchunks")
-        pnew = p.buffer(-o.dist_between_paths, o.circle_detail)
-        # print("pnew")
 
         nchunks = limitChunks(nchunks, o)
         chunksFromCurve.extend(nchunks)
@@ -339,7 +341,7 @@ def pocket(o):
 
         percent = int(i / approxn * 100)
         progress('outlining polygons ', percent)
-        p = pnew
+        p = next(rings, sgeometry.Polygon())
 
         i += 1
 
@@ -571,8 +573,6 @@ def medial_axis(o):
 
     simple.remove_multiple("medialMesh")
 
-    from cam.voronoi import Site, computeVoronoiDiagram
-
     chunks = []
 
     gpoly = spolygon.Polygon()
@@ -619,90 +619,42 @@ def medial_axis(o):
         schunks = chunksRefineThreshold(schunks, o.medial_axis_subdivision,
                                         o.medial_axis_threshold)  # chunksRefine(schunks,o)
 
-        verts = []
-        for ch in schunks:
-            for pt in ch.points:
-                # pvoro = Site(pt[0], pt[1])
-                verts.append(pt)  # (pt[0], pt[1]), pt[2])
-        # verts= points#[[vert.x, vert.y, vert.z] for vert in vertsPts]
-        nDupli, nZcolinear = unique(verts)
-        nVerts = len(verts)
-        print(str(nDupli) + " duplicates points ignored")
-        print(str(nZcolinear) + " z colinear points excluded")
+        verts = numpy.array([pt for ch in schunks for pt in ch.points], dtype=float).reshape(-1, 3)
+        nVerts = len(numpy.unique(verts, axis=0))
+        xy = numpy.unique(verts[:, :2], axis=0)
+        print(str(len(verts) - nVerts) + " duplicates points ignored")
+        print(str(nVerts - len(xy)) + " z colinear points excluded")
+        nVerts = len(xy)
         if nVerts < 3:
             print("Not enough points")
             return {'FINISHED'}
         # Check colinear
-        xValues = [pt[0] for pt in verts]
-        yValues = [pt[1] for pt in verts]
-        if checkEqual(xValues) or checkEqual(yValues):
+        if numpy.all(xy[:, 0] == xy[0, 0]) or numpy.all(xy[:, 1] == xy[0, 1]):
             print("Points are colinear")
             return {'FINISHED'}
         # Create diagram
         print("Tesselation... (" + str(nVerts) + " points)")
-        xbuff, ybuff = 5, 5  # %
-        zPosition = 0
-        vertsPts = [Point(vert[0], vert[1], vert[2]) for vert in verts]
-        # vertsPts= [Point(vert[0], vert[1]) for vert in verts]
-
-        pts, edgesIdx = computeVoronoiDiagram(vertsPts, xbuff, ybuff, polygonsOutput=False, formatOutput=True)
+        pts, edgesIdx = polygon_utils_cam.getVoronoiEdges(xy)
 
-        # pts=[[pt[0], pt[1], zPosition] for pt in pts]
-        newIdx = 0
-        vertr = []
-        filteredPts = []
         print('filter points')
-        ipts = 0
-        for p in pts:
-            ipts = ipts + 1
-            if ipts % 500 == 0:
-                sys.stdout.write('\r')
-                # the exact output you're looking for:
-                prog_message = "points: " + str(ipts) + " / " + str(len(pts)) + " " + str(
-                    round(100 * ipts / len(pts))) + "%"
-                sys.stdout.write(prog_message)
-                sys.stdout.flush()
-
-            if not poly.contains(sgeometry.Point(p)):
-                vertr.append((True, -1))
-            else:
-                vertr.append((False, newIdx))
-                if o.cutter_type == 'VCARVE':
-                    # start the z depth calc from the "start depth" of the operation.
-                    z = o.maxz - mpoly.boundary.distance(sgeometry.Point(p)) * slope
-                    if z < maxdepth:
-                        z = maxdepth
-                elif o.cutter_type == 'BALL' or o.cutter_type == 'BALLNOSE':
-                    d = mpoly_boundary.distance(sgeometry.Point(p))
-                    r = new_cutter_diameter / 2.0
-                    if d >= r:
-                        z = -r
-                    else:
-                        # print(r, d)
-                        z = -r + sqrt(r * r - d * d)
-                else:
-                    z = 0  #
-                # print(mpoly.distance(sgeometry.Point(0,0)))
-                # if(z!=0):print(z)
-                filteredPts.append((p[0], p[1], z))
-                newIdx += 1
+        inside = polygon_utils_cam.containsPoints(poly, pts[:, 0], pts[:, 1])
+        pts = pts[inside]
+        d = polygon_utils_cam.distancePoints(mpoly_boundary, pts[:, 0], pts[:, 1])
+        if o.cutter_type == 'VCARVE':
+            # start the z depth calc from the "start depth" of the operation.
+            z = numpy.maximum(o.maxz - d * slope, maxdepth)
+        elif o.cutter_type == 'BALL' or o.cutter_type == 'BALLNOSE':
+            r = new_cutter_diameter / 2.0
+            z = -r + numpy.sqrt(numpy.maximum(r * r - d * d, 0))
+        else:
+            z = numpy.zeros(len(pts))
+        filteredPts = numpy.column_stack((pts, z))
 
         print('filter edges')
-        filteredEdgs = []
-        ledges = []
-        for e in edgesIdx:
-            do = True
-            # p1 = pts[e[0]]
-            # p2 = pts[e[1]]
-            # print(p1,p2,len(vertr))
-            if vertr[e[0]][0]:  # exclude edges with allready excluded points
-                do = False
-            elif vertr[e[1]][0]:
-                do = False
-            if do:
-                filteredEdgs.append((vertr[e[0]][1], vertr[e[1]][1]))
-                ledges.append(sgeometry.LineString((filteredPts[vertr[e[0]][1]], filteredPts[vertr[e[1]][1]])))
-        # print(ledges[-1].has_z)
+        # exclude edges with allready excluded points
+        newIdx = numpy.cumsum(inside) - 1
+        edgesIdx = edgesIdx[inside[edgesIdx[:, 0]] & inside[edgesIdx[:, 1]]]
+        ledges = [sgeometry.LineString(e) for e in filteredPts[newIdx[edgesIdx]].tolist()]
 
         bufpoly = poly.buffer(-new_cutter_diameter / 2, resolution=64)
 
@@ -791,65 +743,64 @@ def chunksToMesh(chunks, o):
         else:
             origin = (0, 0, free_movement_height)
 
-        verts = [origin]
+        verts = [numpy.array([origin], dtype=float)]
     if o.machine_axes != '3':
         verts_rotations = []  # (0,0,0)
     if (o.machine_axes == '5' and o.strategy5axis == 'INDEXED') or (
             o.machine_axes == '4' and o.strategy4axis == 'INDEXED'):
         extendChunks5axis(chunks, o)
 
-    if o.array:
-        nchunks = []
-        for x in range(0, o.array_x_count):
-            for y in range(0, o.array_y_count):
-                print(x, y)
-                for ch in chunks:
-                    ch = ch.copy()
-                    ch.shift(x * o.array_x_distance, y * o.array_y_distance, 0)
-                    nchunks.append(ch)
-        chunks = nchunks
-
     progress('building paths from chunks')
+    if o.optimize:
+        for ch in chunks:
+            if len(ch.points) > 0:  # first and last points stay, so the lifts below don't change
+                optimizeChunk(ch, o)
+
+    # point arrays of chunks, empty chunks stay in so they still force a lift
+    points = [numpy.array(ch.points, dtype=float).reshape(-1, 3) for ch in chunks]
+    nchunks = len(chunks)
+    shifts = numpy.zeros((1, 3))
+    if o.array:
+        # all copies of a chunk at once, in the same order as the shifted chunk copies were made before
+        shifts = numpy.zeros((o.array_x_count, o.array_y_count, 3))
+        shifts[:, :, 0] = numpy.arange(o.array_x_count)[:, numpy.newaxis] * o.array_x_distance
+        shifts[:, :, 1] = numpy.arange(o.array_y_count)[numpy.newaxis, :] * o.array_y_distance
+        shifts = shifts.reshape(-1, 3)
+        copies = [p[numpy.newaxis] + shifts[:, numpy.newaxis] for p in points]
+        points = [copies[ci][ai] for ai in range(len(shifts)) for ci in range(nchunks)]
+        chunks = chunks * len(shifts)
     e = 0.0001
     lifted = True
+    indexed = o.machine_axes == '3' or (o.machine_axes == '5' and o.strategy5axis == 'INDEXED') or (
+            o.machine_axes == '4' and o.strategy4axis == 'INDEXED')
 
     for chi in range(0, len(chunks)):
-
-        # print(chi)
-
         ch = chunks[chi]
-        # print(chunks)
-        # print (ch)
-        if len(ch.points) > 0:  # TODO: there is a case where parallel+layers+zigzag ramps send empty chunks here...
-            # print(len(ch.points))
-            nverts = []
-            if o.optimize:
-                ch = optimizeChunk(ch, o)
-
+        chpoints = points[chi]
+        if len(chpoints) > 0:  # TODO: there is a case where parallel+layers+zigzag ramps send empty chunks here...
             # lift and drop
 
             if lifted:  # did the cutter lift before? if yes, put a new position above of the first point of next chunk.
-                if o.machine_axes == '3' or (o.machine_axes == '5' and o.strategy5axis == 'INDEXED') or (
-                        o.machine_axes == '4' and o.strategy4axis == 'INDEXED'):
-                    v = (ch.points[0][0], ch.points[0][1], free_movement_height)
+                if indexed:
+                    v = (chpoints[0][0], chpoints[0][1], free_movement_height)
                 else:  # otherwise, continue with the next chunk without lifting/dropping
-                    v = ch.startpoints[0]  # startpoints=retract points
-                    verts_rotations.append(ch.rotations[0])
-                verts.append(v)
+                    v = shifts[chi // nchunks] + ch.startpoints[0]  # startpoints=retract points
+                    verts_rotations.append(ch.rotations[:1])
+                verts.append(numpy.array([v], dtype=float))
 
             # add whole chunk
-            verts.extend(ch.points)
+            verts.append(chpoints)
 
             # add rotations for n-axis
             if o.machine_axes != '3':
-                verts_rotations.extend(ch.rotations)
+                verts_rotations.append(ch.rotations)
 
             lift = True
             # check if lifting should happen
-            if chi < len(chunks) - 1 and len(chunks[chi + 1].points) > 0:
+            if chi < len(chunks) - 1 and len(points[chi + 1]) > 0:
                 # TODO: remake this for n axis, and this check should be somewhere else...
-                last = Vector(ch.points[-1])
-                first = Vector(chunks[chi + 1].points[0])
+                last = Vector(chpoints[-1])
+                first = Vector(points[chi + 1][0])
                 vect = first - last
                 if (o.machine_axes == '3' and (o.strategy == 'PARALLEL' or o.strategy == 'CROSS')
                     and vect.z == 0 and vect.length < o.dist_between_paths * 2.5) \
@@ -860,30 +811,32 @@ def chunksToMesh(chunks, o):
                     lift = False
 
             if lift:
-                if o.machine_axes == '3' or (o.machine_axes == '5' and o.strategy5axis == 'INDEXED') or (
-                        o.machine_axes == '4' and o.strategy4axis == 'INDEXED'):
-                    v = (ch.points[-1][0], ch.points[-1][1], free_movement_height)
+                if indexed:
+                    v = (chpoints[-1][0], chpoints[-1][1], free_movement_height)
                 else:
-                    v = ch.startpoints[-1]
-                    verts_rotations.append(ch.rotations[-1])
-                verts.append(v)
+                    v = shifts[chi // nchunks] + ch.startpoints[-1]
+                    verts_rotations.append(ch.rotations[-1:])
+                verts.append(numpy.array([v], dtype=float))
             lifted = lift
-    # print(verts_rotations)
     if o.use_exact and not o.use_opencamlib:
         cleanupBulletCollision(o)
     print(time.time() - t)
     t = time.time()
 
     # actual blender object generation starts here:
-    edges = []
-    for a in range(0, len(verts) - 1):
-        edges.append((a, a + 1))
+    verts = numpy.concatenate(verts) if len(verts) > 0 else numpy.zeros((0, 3))
+    edges = numpy.arange(len(verts) - 1)
+    edges = numpy.stack((edges, edges + 1), axis=1)
 
     oname = "cam_path_{}".format(o.name)
 
     mesh = bpy.data.meshes.new(oname)
     mesh.name = oname
-    mesh.from_pydata(verts, edges, [])
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set('co', verts.astype(numpy.float32).ravel())
+    mesh.edges.add(len(edges))
+    mesh.edges.foreach_set('vertices', edges.astype(numpy.int32).ravel())
+    mesh.update()
 
     if oname in s.objects:
         s.objects[oname].data = mesh
@@ -899,11 +852,12 @@ def chunksToMesh(chunks, o):
         ob.shape_key_add()
         shapek = mesh.shape_keys.key_blocks[1]
         shapek.name = 'rotations'
-        print(len(shapek.data))
-        print(len(verts_rotations))
-
-        for i, co in enumerate(verts_rotations):  # TODO: optimize this. this is just rewritten too many times...
-            shapek.data[i].co = co
+        rotations = numpy.zeros((len(verts), 3))
+        verts_rotations = [numpy.array(r, dtype=float).reshape(-1, 3) for r in verts_rotations]
+        if len(verts_rotations) > 0:
+            verts_rotations = numpy.concatenate(verts_rotations)[:len(verts)]
+            rotations[:len(verts_rotations)] = verts_rotations
+        shapek.data.foreach_set('co', rotations.astype(numpy.float32).ravel())
 
     print(time.time() - t)
 
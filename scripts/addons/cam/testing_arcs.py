@@ -0,0 +1,123 @@
+# checks of the arc fitting in arcs.py against the original polylines.
+# arcs.py doesn't import bpy, so this runs with plain python: python testing_arcs.py
+
+import importlib.util
+import math
+import os
+import numpy
+
+spec = importlib.util.spec_from_file_location('arcs', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   'arcs.py'))
+arcs = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(arcs)
+
+
+def arcDeviation(co, start, end, cx, cy, cw):
+    """largest distance of the points and of the segments of the polyline from start to end
+    from the arc written for them. the arc has the radius of its start point, z changes linearly with the angle"""
+    p = co[start:end + 1]
+    r = math.hypot(p[0, 0] - cx, p[0, 1] - cy)
+    angles = numpy.unwrap(numpy.arctan2(p[:, 1] - cy, p[:, 0] - cx))
+    steps = numpy.diff(angles)
+    if (cw and (steps >= 0).any()) or (not cw and (steps <= 0).any()):
+        return math.inf, math.inf
+    turned = numpy.abs(angles - angles[0])
+    zline = p[0, 2] + (p[-1, 2] - p[0, 2]) * turned / turned[-1]
+    vertex = max(numpy.abs(numpy.hypot(p[:, 0] - cx, p[:, 1] - cy) - r).max(), numpy.abs(p[:, 2] - zline).max())
+    # the chord point furthest from the arc is the one closest to the center
+    a = p[:-1, :2]
+    ab = p[1:, :2] - a
+    t = numpy.clip(((numpy.array((cx, cy)) - a) * ab).sum(axis=1) / (ab * ab).sum(axis=1), 0, 1)
+    closest = a + ab * t[:, numpy.newaxis]
+    chord = numpy.abs(numpy.hypot(closest[:, 0] - cx, closest[:, 1] - cy) - r).max()
+    return vertex, chord
+
+
+def checkArcs(co, tolerance, helical=True, feedmove=None):
+    """fits arcs to co and asserts none of them deviates from the polyline more than tolerance,
+    returns the arcs"""
+    co = numpy.asarray(co, dtype=numpy.float64)
+    if feedmove is None:
+        feedmove = numpy.ones(len(co), dtype=bool)
+    found = arcs.getArcs(co, feedmove, tolerance, helical)
+    covered = numpy.zeros(len(co), dtype=int)
+    for end, (start, cx, cy, cw, length) in found.items():
+        assert feedmove[start + 1:end + 1].all(), 'arc over a move which is not milling'
+        covered[start + 1:end + 1] += 1
+        vertex, chord = arcDeviation(co, start, end, cx, cy, cw)
+        assert vertex <= tolerance, 'arc %i-%i vertex deviation %g' % (start, end, vertex)
+        assert chord <= tolerance, 'arc %i-%i chord deviation %g' % (start, end, chord)
+    assert covered.max(initial=0) <= 1, 'overlapping arcs'
+    return found
+
+
+def circle(cx, cy, r, a0, a1, n, z0=0, z1=None):
+    a = numpy.linspace(a0, a1, n)
+    z = numpy.linspace(z0, z0 if z1 is None else z1, n)
+    return numpy.column_stack((cx + r * numpy.cos(a), cy + r * numpy.sin(a), z))
+
+
+def checkCircles():
+    for r, n in ((10, 200), (0.5, 37), (100, 1000)):
+        for direction in (1, -1):
+            co = circle(1, -2, r, 0, direction * 4 * math.pi, n)
+            assert len(checkArcs(co, 0.01)) > 0
+            checkArcs(co, 0.0001)
+
+
+def checkHelices():
+    co = circle(0, 0, 5, 0, 6 * math.pi, 300, 0, -3)
+    assert len(checkArcs(co, 0.005)) > 0
+    assert len(checkArcs(co, 0.005, helical=False)) == 0
+    # z not linear with the angle
+    co[:, 2] = -numpy.linspace(0, 1, len(co)) ** 2
+    checkArcs(co, 0.001)
+
+
+def checkNoisyArcs():
+    rng = numpy.random.default_rng(0)
+    tolerance = 0.01
+    co = circle(3, 4, 20, 0.3, 2.5, 400)
+    co[:, :2] += rng.uniform(-0.3, 0.3, (len(co), 2)) * tolerance
+    assert len(checkArcs(co, tolerance)) > 0
+    co[:, :2] += rng.uniform(-3, 3, (len(co), 2)) * tolerance
+    checkArcs(co, tolerance)
+    co[:, 2] += rng.uniform(-2, 2, len(co)) * tolerance
+    checkArcs(co, tolerance)
+
+
+def checkStraightRuns():
+    t = numpy.linspace(0, 1, 100)
+    co = numpy.column_stack((t * 10, t * 3, -t))
+    assert len(checkArcs(co, 0.01)) == 0
+    zigzag = numpy.column_stack((numpy.arange(50), numpy.arange(50) % 2, numpy.zeros(50)))
+    assert len(checkArcs(zigzag, 0.01)) == 0
+
+
+def checkMixedPaths():
+    line = numpy.column_stack((numpy.linspace(-10, 0, 20), numpy.full(20, -5), numpy.zeros(20)))
+    arc = circle(0, 0, 5, -math.pi / 2, math.pi / 2, 60)[1:]
+    back = numpy.column_stack((numpy.linspace(0, -10, 20), numpy.full(20, 5), numpy.zeros(20)))[1:]
+    co = numpy.vstack((line, arc, back))
+    found = checkArcs(co, 0.005)
+    assert len(found) == 1
+    end, arc = found.popitem()
+    assert arc[0] >= 18 and end <= 79
+    # a move which isn't milling splits the arcs
+    feedmove = numpy.ones(len(co), dtype=bool)
+    feedmove[50] = False
+    assert len(checkArcs(co, 0.005, feedmove=feedmove)) == 2
+
+
+checks = [
+    checkCircles,
+    checkHelices,
+    checkNoisyArcs,
+    checkStraightRuns,
+    checkMixedPaths,
+]
+
+if __name__ == '__main__':
+    for check in checks:
+        check()
+        print(check.__name__ + ' ok')
@@ -0,0 +1,98 @@
+# checks of the simulation feedrate graph in simulation_load.py against the step by step loop it replaced.
+# simulation_load.py doesn't import bpy, so this runs with plain python: python testing_simulation.py
+
+import importlib.util
+import math
+import os
+import numpy
+
+spec = importlib.util.spec_from_file_location('simulation_load', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'simulation_load.py'))
+simulation_load = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(simulation_load)
+
+
+def loopLoadGraph(co, volumes):
+    """load graph as the simulation loop wrote it into the shape key, volumes are taken away at each vertex"""
+    x = [0.0] * len(co)
+    y = [0.0] * len(co)
+    lasts = co[1]
+    for i in range(1, len(co)):
+        s = co[i]
+        l = math.dist(s, lasts)
+        load = volumes[i] / l if l > 0 else 0
+        if l != 0:
+            y[i] = load * 0.000002
+        else:
+            y[i] = y[i - 1]
+        x[i] = x[i - 1] + l * 0.04
+        lasts = s
+    return x, y
+
+
+def loopSmoothLoads(x, y, passes=10):
+    """smoothing as the simulation loop did it, weights are kept from the last neighbour at a distance"""
+    n = len(y)
+    xcoef = x[-1] / n
+    for a in range(0, passes):
+        nvals = []
+        val1 = 0
+        val2 = 0
+        w1 = 0
+        w2 = 0
+        for i in range(n):
+            val = y[i]
+            if i > 1:
+                val1 = y[i - 1]
+                if x[i - 1] - x[i] != 0:
+                    w1 = 1 / (abs(x[i - 1] - x[i]) / xcoef)
+            if i < n - 1:
+                val2 = y[i + 1]
+                if x[i + 1] - x[i] != 0:
+                    w2 = 1 / (abs(x[i + 1] - x[i]) / xcoef)
+            nvals.append((val + val1 * w1 + val2 * w2) / (1.0 + w1 + w2))
+        y = nvals
+    return y
+
+
+def checkPath(co, stampverts, volumes):
+    co = numpy.asarray(co, dtype=float)
+    graph = simulation_load.getSimulationLoadGraph(co, stampverts, volumes)
+    x, y = loopLoadGraph(co.tolist(), numpy.bincount(stampverts, weights=volumes, minlength=len(co)).tolist())
+    assert numpy.allclose(graph[:, 0], x, rtol=1e-12, atol=0), 'graph x differs'
+    assert numpy.allclose(graph[:, 1], y, rtol=1e-12, atol=0), 'graph loads differ'
+    smoothed = simulation_load.smoothSimulationLoads(graph[:, 0], graph[:, 1])
+    assert numpy.allclose(smoothed, loopSmoothLoads(x, y), rtol=1e-9, atol=0), 'smoothed loads differ'
+
+
+def checkRandomPaths():
+    rng = numpy.random.default_rng(0)
+    for n in (2, 3, 10, 500):
+        co = rng.uniform(-0.05, 0.05, (n, 3))
+        # the path starts at the origin, like the paths made by chunksToMesh
+        co[0] = 0
+        stampverts = numpy.sort(rng.integers(0, n, 4 * n))
+        checkPath(co, stampverts, rng.uniform(0, 1e-6, len(stampverts)))
+
+
+def checkRepeatedPoints():
+    rng = numpy.random.default_rng(1)
+    co = rng.uniform(-0.05, 0.05, (200, 3))
+    co[0] = 0
+    # zero length moves keep the previous load and weights
+    co[10:15] = co[9]
+    co[100] = co[99]
+    co[-3:] = co[-4]
+    stampverts = numpy.sort(rng.integers(0, len(co), 800))
+    checkPath(co, stampverts, rng.uniform(0, 1e-6, len(stampverts)))
+
+
+checks = [
+    checkRandomPaths,
+    checkRepeatedPoints,
+]
+
+if __name__ == '__main__':
+    for check in checks:
+        check()
+        print(check.__name__ + ' ok')
@@ -144,6 +144,11 @@ class CAM_OPERATIONS_Panel(CAMButtonsPanel, bpy.types.Panel):
             layout.label(text='is high')
             layout.prop(ao, 'simplify_tol')
 
+        if ao.strategy != 'DRILL' and ao.machine_axes == '3':
+            layout.prop(ao, 'use_arc_fitting')
+            if ao.use_arc_fitting:
+                layout.prop(ao, 'arc_tolerance')
+
         if ao.geometry_source in ['OBJECT', 'COLLECTION']:
             layout.prop(ao, 'use_modifiers')
         layout.prop(ao, 'hide_all_others')
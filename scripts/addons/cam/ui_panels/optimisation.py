@@ -34,6 +34,8 @@ class CAM_OPTIMISATION_Panel(CAMButtonsPanel, bpy.types.Panel):
                         else:
                             layout.label(text=f"Opencamlib v{opencamlib_version} installed")
                             layout.prop(ao, 'use_opencamlib')
+                            if ao.use_opencamlib and ao.strategy == 'WATERLINE':
+                                layout.prop(ao, 'waterline_sampling')
 
                     if exclude_exact or not ao.use_exact:
                         layout.prop(ao, 'pixsize')
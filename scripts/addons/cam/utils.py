@@ -342,17 +342,17 @@ def samplePathLow(o, ch1, ch2, dosample):
                     o.update_bullet_collision_tag = False
 
                 cutterdepth = o.cutter_shape.dimensions.z / 2
-                for p in bpath.points:
+                for i, p in enumerate(bpath.points):
                     z = getSampleBullet(o.cutter_shape, p[0], p[1], cutterdepth, 1, o.minz)
                     if z > p[2]:
-                        p[2] = z
+                        bpath.points[i] = (p[0], p[1], z)
             else:
-                for p in bpath.points:
+                for i, p in enumerate(bpath.points):
                     xs = (p[0] - o.min.x) / pixsize + o.borderwidth + pixsize / 2  # -m
                     ys = (p[1] - o.min.y) / pixsize + o.borderwidth + pixsize / 2  # -m
                     z = getSampleImage((xs, ys), o.offset_image, o.minz) + o.skin
                     if z > p[2]:
-                        p[2] = z
+                        bpath.points[i] = (p[0], p[1], z)
     return bpath
 
 
@@ -362,6 +362,7 @@ def sampleChunks(o, pathSamples, layers):
     #
     minx, miny, minz, maxx, maxy, maxz = o.min.x, o.min.y, o.min.z, o.max.x, o.max.y, o.max.z
     getAmbient(o)
+    ambientmask = getAmbientMask(o)
 
     if o.use_exact:  # prepare collision world
         if o.use_opencamlib:
@@ -415,6 +416,13 @@ def sampleChunks(o, pathSamples, layers):
     totaltime = timinginit()
     timingstart(totaltime)
     lastz = minz
+    if not o.use_exact and len(pathSamples) > 0:
+        # image sampling is done for all points at once, in worker processes for big paths
+        timingstart(samplingtime)
+        allsamples = getSamplePointsParallel(numpy.concatenate([ch.pointsArray() for ch in pathSamples]),
+                                             o.offset_image, minx, miny, pixsize, coordoffset, minz) + o.skin
+        timingadd(samplingtime)
+        sampleindex = 0
     for patternchunk in pathSamples:
         thisrunchunks = []
         for l in layers:
@@ -422,18 +430,24 @@ def sampleChunks(o, pathSamples, layers):
         lastlayer = None
         currentlayer = None
         lastsample = None
-        # threads_count=4
 
-        # for t in range(0,threads):
+        chunkpoints = numpy.array(patternchunk.points, dtype=float).reshape(-1, 3)
+        chunkinside = ambientmask.containsPoints(chunkpoints[:, 0], chunkpoints[:, 1])
+        if o.use_exact and not o.use_opencamlib:
+            # sweeps start just above the highest surface the cutter can touch, instead of far above the model
+            chunkbounds = getBulletHeightBounds(o, chunkpoints).tolist()
+        if not o.use_exact:  # the loop below only sorts image samples into layers
+            chunksamples = allsamples[sampleindex:sampleindex + len(chunkpoints)]
+            sampleindex += len(chunkpoints)
 
-        for s in patternchunk.points:
+        for si, s in enumerate(patternchunk.points):
             if o.strategy != 'WATERLINE' and int(100 * n / totlen) != last_percent:
                 last_percent = int(100 * n / totlen)
                 progress('sampling paths ', last_percent)
             n += 1
             x = s[0]
             y = s[1]
-            if not o.ambient.contains(sgeometry.Point(x, y)):
+            if not chunkinside[si]:
                 newsample = (x, y, 1)
             else:
                 if o.use_opencamlib and o.use_exact:
@@ -443,23 +457,25 @@ def sampleChunks(o, pathSamples, layers):
                     newsample = (x, y, z)
                 # ampling
                 elif o.use_exact and not o.use_opencamlib:
-
-                    if lastsample is not None:  # this is an optimalization,
-                        # search only for near depths to the last sample. Saves about 30% of sampling time.
-                        z = getSampleBullet(cutter, x, y, cutterdepth, 1,
-                                            lastsample[2] - o.dist_along_paths)  # first try to the last sample
-                        if z < minz - 1:
-                            z = getSampleBullet(cutter, x, y, cutterdepth, lastsample[2] - o.dist_along_paths, minz)
+                    bound = chunkbounds[si]
+                    if bound < minz:  # nothing to touch above minz
+                        z = minz
                     else:
-                        z = getSampleBullet(cutter, x, y, cutterdepth, 1, minz)
+                        startz = min(1, bound + cutterdepth / BULLET_SCALE + 0.0001)
+                        if lastsample is not None and lastsample[2] - o.dist_along_paths < startz:
+                            # this is an optimalization,
+                            # search only for near depths to the last sample. Saves about 30% of sampling time.
+                            z = getSampleBullet(cutter, x, y, cutterdepth, startz,
+                                                lastsample[2] - o.dist_along_paths)  # first try to the last sample
+                            if z < minz - 1:
+                                z = getSampleBullet(cutter, x, y, cutterdepth, lastsample[2] - o.dist_along_paths,
+                                                    minz)
+                        else:
+                            z = getSampleBullet(cutter, x, y, cutterdepth, startz, minz)
 
                 # print(z)
                 else:
-                    timingstart(samplingtime)
-                    xs = (x - minx) / pixsize + coordoffset
-                    ys = (y - miny) / pixsize + coordoffset
-                    timingadd(samplingtime)
-                    z = getSampleImage((xs, ys), o.offset_image, minz) + o.skin
+                    z = chunksamples.item(si)
 
                 ################################
                 # handling samples
@@ -621,8 +637,38 @@ def sampleChunksNAxis(o, pathSamples, layers):
         lastrunchunks.append([])
     n = 0
 
+    # sample points grouped by cutter rotation, so the rigidbody world has to be updated
+    # only once for each rotation, not every time the rotation changes along the path.
+    chunksamples = []
+    rotationgroups = {}
+    for ci, patternchunk in enumerate(pathSamples):
+        chunksamples.append([None] * len(patternchunk.startpoints))
+        for si in range(0, len(patternchunk.startpoints)):
+            rotationgroups.setdefault(tuple(patternchunk.rotations[si]), []).append((ci, si))
+
+    for rotation, group in rotationgroups.items():
+        cutter.rotation_euler = rotation
+        # cutter.rotation_euler.x=-cutter.rotation_euler.x
+        # print(rotation)
+
+        if o.cutter_type == 'VCARVE':  # Bullet cone is always pointing Up Z in the object
+            cutter.rotation_euler.x += pi
+        cutter.update_tag()
+        bpy.context.scene.frame_set(1)  # this has to be :( it resets the rigidbody world.
+        # No other way to update it probably now :(
+        bpy.context.scene.frame_set(2)  # actually 2 frame jumps are needed.
+        bpy.context.scene.frame_set(0)
+
+        for ci, si in group:
+            if n / 200.0 == int(n / 200.0):
+                progress('sampling paths ', int(100 * n / totlen))
+            n += 1
+            patternchunk = pathSamples[ci]
+            chunksamples[ci][si] = getSampleBulletNAxis(cutter, Vector(patternchunk.startpoints[si]),
+                                                        Vector(patternchunk.endpoints[si]), rotation, cutterdepth)
+
     lastz = minz
-    for patternchunk in pathSamples:
+    for ci, patternchunk in enumerate(pathSamples):
         # print (patternchunk.endpoints)
         thisrunchunks = []
         for l in layers:
@@ -639,9 +685,6 @@ def sampleChunksNAxis(o, pathSamples, layers):
             # #TODO: seems we are writing into the source chunk ,
             #  and that is why we need to write endpoints everywhere too?
 
-            if n / 200.0 == int(n / 200.0):
-                progress('sampling paths ', int(100 * n / totlen))
-            n += 1
             sampled = False
             # print(si)
 
@@ -651,22 +694,8 @@ def sampleChunksNAxis(o, pathSamples, layers):
             rotation = patternchunk.rotations[si]
             sweepvect = endp - startp
             sweepvect.normalize()
-            # sampling
-            if rotation != lastrotation:
-
-                cutter.rotation_euler = rotation
-                # cutter.rotation_euler.x=-cutter.rotation_euler.x
-                # print(rotation)
-
-                if o.cutter_type == 'VCARVE':  # Bullet cone is always pointing Up Z in the object
-                    cutter.rotation_euler.x += pi
-                cutter.update_tag()
-                bpy.context.scene.frame_set(1)  # this has to be :( it resets the rigidbody world.
-                # No other way to update it probably now :(
-                bpy.context.scene.frame_set(2)  # actually 2 frame jumps are needed.
-                bpy.context.scene.frame_set(0)
-
-            newsample = getSampleBulletNAxis(cutter, startp, endp, rotation, cutterdepth)
+            # sampling was done above
+            newsample = chunksamples[ci][si]
 
             # print('totok',startp,endp,rotation,newsample)
             ################################
@@ -1003,79 +1032,166 @@ def connectChunksLow(chunks, o):
     return connectedchunks
 
 
-def getClosest(o, pos, chunks):
-    # ch=-1
-    mind = 2000
-    d = 100000000000
-    ch = None
-    for chtest in chunks:
-        cango = True
-        for child in chtest.children:  # here was chtest.getNext==chtest, was doing recursion error and slowing down.
-            if not child.sorted:
-                cango = False
-                break
-        if cango:
-            d = chtest.dist(pos, o)
-            if d < mind:
-                ch = chtest
-                mind = d
-    return ch
+class ChunkGrid:
+    """spatial hash over the points chunks can be entered from, for fast nearest chunk search.
+    chunks can be added and removed while sorting, the grid adapts its cell size to the number of points."""
+
+    def __init__(self, o):
+        self.o = o
+        self.chunks = {}  # chunk -> (order, entry points)
+        self.cells = {}
+        self.npoints = 0
+        self.buildpoints = 0
+        self.cellsize = 1.0
+        self.bounds = None
+
+    def entryPoints(self, ch):
+        # the same points camPathChunk.dist measures to
+        if ch.closed:
+            pts = ch.points
+        elif self.o.movement_type == 'MEANDER':
+            pts = [ch.points[0], ch.points[-1]]
+        else:
+            pts = [ch.points[0]]
+        return numpy.array([(p[0], p[1]) for p in pts], dtype=float)
+
+    def insert(self, ch, pts):
+        keys = set(zip(*numpy.floor(pts / self.cellsize).astype(int).T.tolist()))
+        for key in keys:
+            self.cells.setdefault(key, []).append(ch)
+        kx = [k[0] for k in keys]
+        ky = [k[1] for k in keys]
+        b = (min(kx), min(ky), max(kx), max(ky))
+        if self.bounds is None:
+            self.bounds = b
+        else:
+            self.bounds = (min(self.bounds[0], b[0]), min(self.bounds[1], b[1]), max(self.bounds[2], b[2]),
+                           max(self.bounds[3], b[3]))
+
+    def rebuild(self):
+        self.cells = {}
+        self.bounds = None
+        self.buildpoints = self.npoints
+        if self.npoints == 0:
+            return
+        allpts = numpy.vstack([c[1] for c in self.chunks.values()])
+        size = allpts.max(axis=0) - allpts.min(axis=0)
+        self.cellsize = max(math.sqrt(size[0] * size[1] / self.npoints) * 1.5, size.max() / self.npoints, 1e-7)
+        for ch, (order, pts) in self.chunks.items():
+            self.insert(ch, pts)
+
+    def add(self, ch, order):
+        pts = self.entryPoints(ch)
+        if len(pts) == 0:
+            return
+        self.chunks[ch] = (order, pts)
+        self.npoints += len(pts)
+        if self.npoints > 4 * self.buildpoints + 16:
+            self.rebuild()
+        else:
+            self.insert(ch, pts)
+
+    def remove(self, ch):
+        if ch in self.chunks:
+            order, pts = self.chunks.pop(ch)
+            self.npoints -= len(pts)
+            if self.npoints < self.buildpoints / 4:
+                self.rebuild()
+
+    def ringCells(self, cx, cy, r):
+        x0, y0, x1, y1 = self.bounds
+        if r == 0:
+            yield cx, cy
+            return
+        for y in (cy - r, cy + r):
+            if y0 <= y <= y1:
+                for x in range(max(cx - r, x0), min(cx + r, x1) + 1):
+                    yield x, y
+        for x in (cx - r, cx + r):
+            if x0 <= x <= x1:
+                for y in range(max(cy - r + 1, y0), min(cy + r - 1, y1) + 1):
+                    yield x, y
+
+    def closest(self, pos):
+        """closest chunk to pos, on equal distances the one coming first in the original chunk list"""
+        if len(self.chunks) == 0:
+            return None
+        cx = int(floor(pos[0] / self.cellsize))
+        cy = int(floor(pos[1] / self.cellsize))
+        x0, y0, x1, y1 = self.bounds
+        r = max(x0 - cx, cx - x1, y0 - cy, cy - y1, 0)  # rings before this one are outside of the grid
+        rmax = max(abs(x0 - cx), abs(x1 - cx), abs(y0 - cy), abs(y1 - cy))
+        best = None
+        tested = set()
+        while r <= rmax and (best is None or (r - 1) * self.cellsize <= best[0]):
+            for key in self.ringCells(cx, cy, r):
+                cell = self.cells.get(key)
+                if cell is None:
+                    continue
+                cell[:] = [ch for ch in cell if ch in self.chunks]  # drop removed chunks
+                for ch in cell:
+                    if ch in tested:
+                        continue
+                    tested.add(ch)
+                    order, pts = self.chunks[ch]
+                    if len(pts) > 8:
+                        d = numpy.hypot(pts[:, 0] - pos[0], pts[:, 1] - pos[1]).min()
+                    else:
+                        d = min(hypot(p[0] - pos[0], p[1] - pos[1]) for p in pts.tolist())
+                    if best is None or (d, order) < best:
+                        best = (d, order, ch)
+            r += 1
+        return best[2]
 
 
 def sortChunks(chunks, o):
+    """orders chunks by greedy nearest neighbour, children are milled before their parents.
+    available chunks are kept in a ChunkGrid, so the search doesn't scan all chunks."""
     if o.strategy != 'WATERLINE':
         progress('sorting paths')
-    sys.setrecursionlimit(100000)  # the getNext() function of CamPathChunk was running out of recursion limits.
     sortedchunks = []
-    chunks_to_resample = []
+
+    remaining = {}  # chunk -> original order
+    for i, ch in enumerate(chunks):
+        remaining[ch] = i
+    grid = ChunkGrid(o)  # holds chunks which can be milled now, all their children are done
+    for ch, i in remaining.items():
+        if all(child.sorted for child in ch.children):
+            grid.add(ch, i)
 
     lastch = None
-    i = len(chunks)
     pos = (0, 0, 0)
-    # for ch in chunks:
-    # ch.getNext()#this stores the unsortedchildren properties
-    # print('numofchunks')
-    # print(len(chunks))
-    while len(chunks) > 0:
+    while len(remaining) > 0:
         ch = None
-        if len(sortedchunks) == 0 or len(
-                lastch.parents) == 0:  # first chunk or when there are no parents -> parents come after children here...
-            ch = getClosest(o, pos, chunks)
-        elif len(lastch.parents) > 0:  # looks in parents for next candidate, recursively
+        if lastch is not None and len(lastch.parents) > 0:  # looks in parents for next candidate
             for parent in lastch.parents:
                 ch = parent.getNextClosest(o, pos)
-                if ch is not None:
+                if ch is not None and ch in remaining:
                     break
-            if ch is None:
-                ch = getClosest(o, pos, chunks)
-
-        if ch is not None:  # found next chunk, append it to list
-            # only adaptdist the chunk if it has not been sorted before
-            if not ch.sorted:
-                ch.adaptdist(pos, o)
-                ch.sorted = True
-            # print(len(ch.parents),'children')
-            chunks.remove(ch)
-            sortedchunks.append(ch)
-            lastch = ch
-            pos = lastch.points[-1]
-        # print(i, len(chunks))
-        # experimental fix for infinite loop problem
-        # else:
-        # THIS PROBLEM WASN'T HERE AT ALL. but keeping it here, it might fix the problems somwhere else:)
-        # can't find chunks close enough and still some chunks left
-        # to be sorted. For now just move the remaining chunks over to
-        # the sorted list.
-        # This fixes an infinite loop condition that occurs sometimes.
-        # This is a bandaid fix: need to find the root cause of this problem
-        # suspect it has to do with the sorted flag?
-        # print("no chunks found closest. Chunks not sorted: ", len(chunks))
-        # sortedchunks.extend(chunks)
-        # chunks[:] = []
-
-        i -= 1
-
-    sys.setrecursionlimit(1000)
+                ch = None
+        if ch is None:  # first chunk or when there are no parents -> parents come after children here...
+            ch = grid.closest(pos)
+        if ch is None:
+            # children outside of this set of chunks block all the rest, take the closest regardless of them.
+            for c, i in remaining.items():
+                grid.add(c, i)
+            ch = grid.closest(pos)
+
+        # found next chunk, append it to list
+        # only adaptdist the chunk if it has not been sorted before
+        if not ch.sorted:
+            ch.adaptdist(pos, o)
+            ch.sorted = True
+            for parent in ch.parents:
+                if parent in remaining and parent not in grid.chunks and all(c.sorted for c in parent.children):
+                    grid.add(parent, remaining[parent])
+        del remaining[ch]
+        grid.remove(ch)
+        sortedchunks.append(ch)
+        lastch = ch
+        pos = lastch.points[-1]
+
+    chunks[:] = []
     if o.strategy != 'DRILL' and o.strategy != 'OUTLINEFILL':
         # THIS SHOULD AVOID ACTUALLY MOST STRATEGIES, THIS SHOULD BE DONE MANUALLY,
         # BECAUSE SOME STRATEGIES GET SORTED TWICE.
@@ -1150,6 +1266,28 @@ def cutloops(csource, parentloop, loops):
         cutloops(csource, l, loops)
 
 
+# silhouetes and ambients aren't saved with the operations, so they are kept in memory
+# by operation name, with the cache keys they were computed for.
+_operation_polygons = {}
+
+
+def restoreOperationPolygons(o, keys):
+    """tags silhouete and ambient of the operation for an update, unless they are in memory for the same keys"""
+    for name in ('silhouete', 'ambient'):
+        cached = _operation_polygons.get((o.name, name))
+        update = cached is None or cached[0] != keys[name]
+        if not update:
+            setattr(o, name, cached[1])
+        setattr(o, 'update_' + name + '_tag', update)
+
+
+def storeOperationPolygons(o, keys):
+    """keeps silhouete and ambient in memory if they were computed or restored for the operation"""
+    for name in ('silhouete', 'ambient'):
+        if not getattr(o, 'update_' + name + '_tag'):
+            _operation_polygons[(o.name, name)] = (keys[name], getattr(o, name))
+
+
 def getOperationSilhouete(operation):
     """gets silhouete for the operation
         uses image thresholding for everything except curves.
@@ -0,0 +1,7 @@
+################################################################################
+# __init__.py
+#
+# This is here to make python see the workers folder as the cam.workers package.
+# The modules don't import bpy, worker processes still import them standalone
+# with this folder on sys.path.
+#
@@ -0,0 +1,190 @@
+# outlines of image areas, which can be traced in worker processes
+# this module doesn't import bpy or cam, so worker processes can import it standalone
+
+from multiprocessing import shared_memory
+import math
+import numpy
+
+_worker = {}
+
+
+def getSquareSegments():
+    """marching squares table - pairs of crossed cell edges joined by a segment, for every corner case.
+    corners a, b, c, d go around the cell, edge k goes from corner k to corner k + 1.
+    segments start where the outline enters the area above level, so it is always on their right side.
+    saddle cases have a second pair of segments used when the cell center is above level."""
+    table = []
+    for case in range(16):
+        above = [(case >> k) & 1 for k in range(4)]
+        starts = [k for k in range(4) if not above[k] and above[(k + 1) % 4]]
+        ends = [k for k in range(4) if above[k] and not above[(k + 1) % 4]]
+        if len(starts) == 2:
+            # separated - each segment cuts off one corner above level, connected - one below level
+            separated = [(s, (s + 1) % 4) for s in starts]
+            connected = [(s, (s + 3) % 4) for s in starts]
+            table.append((separated, connected))
+        else:
+            segments = list(zip(starts, ends))
+            table.append((segments, segments))
+    return table
+
+
+SQUARE_SEGMENTS = getSquareSegments()
+
+
+def getImageOutlines(image, r=0, level=0.5):
+    """outlines of image areas above level, found by marching squares with sub-pixel interpolation.
+    returns loops as arrays of pixel coordinates, closed loops end with their first point.
+    outlines closer than r to the image border are left out"""
+    image = numpy.asarray(image, dtype=float)
+    w, h = image.shape
+    if w == 0 or h == 0:
+        return []
+    # padding below level closes outlines of areas touching the image border
+    a = numpy.pad(image, 1, constant_values=min(image.min(), level) - 1)
+    above = a > level
+    W, H = a.shape
+    nx = (W - 1) * H  # ids of cell edges along x come first, then edges along y
+
+    cases = (above[:-1, :-1] * 1 + above[1:, :-1] * 2 + above[1:, 1:] * 4 + above[:-1, 1:] * 8)
+    if r > 0:
+        ci = numpy.arange(W - 1)[:, numpy.newaxis] - 1
+        cj = numpy.arange(H - 1)[numpy.newaxis, :] - 1
+        inside = (ci >= r) & (ci < w - 1 - r) & (cj >= r) & (cj < h - 1 - r)
+        cases = numpy.where(inside, cases, 0)
+    # only cells with corners on both sides of level are crossed
+    cells = numpy.flatnonzero((cases > 0) & (cases < 15))
+    cellcases = cases.ravel()[cells]
+    ci, cj = numpy.divmod(cells, H - 1)
+    center = (a[ci, cj] + a[ci + 1, cj] + a[ci + 1, cj + 1] + a[ci, cj + 1]) / 4 > level
+    edgeids = (ci * H + cj, nx + (ci + 1) * (H - 1) + cj, ci * H + cj + 1, nx + ci * (H - 1) + cj)
+
+    starts = []
+    ends = []
+    for case in range(1, 15):
+        incase = numpy.nonzero(cellcases == case)[0]
+        if len(incase) == 0:
+            continue
+        separated, connected = SQUARE_SEGMENTS[case]
+        c = center[incase]
+        for k in range(len(separated)):
+            starts.append(numpy.where(c, edgeids[connected[k][0]][incase], edgeids[separated[k][0]][incase]))
+            ends.append(numpy.where(c, edgeids[connected[k][1]][incase], edgeids[separated[k][1]][incase]))
+    if len(starts) == 0:
+        return []
+    starts = numpy.concatenate(starts)
+    ends = numpy.concatenate(ends)
+
+    # link segments - every crossed edge starts one segment and ends another
+    m = len(starts)
+    index = numpy.arange(m)
+    startof = numpy.full(nx + (W * (H - 1)), -1)
+    startof[starts] = index
+    nxt = startof[ends]
+    terminal = nxt < 0  # outlines cut open at the border
+    nxt[terminal] = index[terminal]
+    rounds = int(math.ceil(math.log2(m))) + 1
+
+    # closed loops are cut open after their lowest segment
+    jump = nxt.copy()
+    lowest = index.copy()
+    for i in range(rounds):
+        lowest = numpy.minimum(lowest, lowest[jump])
+        jump = jump[jump]
+    cut = ~terminal[jump] & (lowest == index)
+    terminal |= cut
+    nxt[cut] = index[cut]
+
+    # order segments of each loop by their distance to its last segment
+    distance = (~terminal).astype(int)
+    jump = nxt.copy()
+    for i in range(rounds):
+        distance += distance[jump]
+        jump = jump[jump]
+    order = numpy.lexsort((-distance, jump))
+    loopstarts = numpy.nonzero(numpy.diff(jump[order]))[0] + 1
+
+    def edgePoints(ids):
+        ids = numpy.asarray(ids)
+        points = numpy.empty((len(ids), 2))
+        alongx = ids < nx
+        i, j = numpy.divmod(ids[alongx], H)
+        t = (level - a[i, j]) / (a[i + 1, j] - a[i, j])
+        points[alongx] = numpy.stack((i + t, j), axis=1)
+        i, j = numpy.divmod(ids[~alongx] - nx, H - 1)
+        t = (level - a[i, j]) / (a[i, j + 1] - a[i, j])
+        points[~alongx] = numpy.stack((i, j + t), axis=1)
+        return points - 1  # back to coordinates without padding
+
+    points = edgePoints(starts[order])
+    lastpoints = edgePoints(ends[order[numpy.append(loopstarts, m) - 1]])
+    outlines = []
+    for li, loop in enumerate(numpy.split(points, loopstarts)):
+        outlines.append(numpy.vstack((loop, lastpoints[li:li + 1])))
+    return outlines
+
+
+def simplifyOutlines(outlines, tolerance):
+    """Ramer-Douglas-Peucker simplification of all outlines at once,
+    points further than tolerance from the simplified outline are kept"""
+    outlines = [o for o in outlines if len(o) > 0]
+    if len(outlines) == 0:
+        return []
+    lengths = numpy.array([len(o) for o in outlines])
+    points = numpy.concatenate(outlines)
+    firsts = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+    lasts = firsts + lengths - 1
+    keep = numpy.zeros(len(points), dtype=bool)
+    keep[firsts] = True
+    keep[lasts] = True
+
+    # closed outlines are first split at the point furthest from their start
+    closed = numpy.all(points[firsts] == points[lasts], axis=1) & (lengths > 2)
+    middles = lasts.copy()
+    for i in numpy.nonzero(closed)[0]:
+        d = points[firsts[i]:lasts[i] + 1] - points[firsts[i]]
+        middles[i] = firsts[i] + numpy.argmax((d * d).sum(axis=1))
+    keep[middles] = True
+    s = numpy.concatenate((firsts, middles[closed]))
+    e = numpy.concatenate((middles, lasts[closed]))
+
+    while len(s) > 0:
+        active = e - s > 1
+        s = s[active]
+        e = e[active]
+        if len(s) == 0:
+            break
+        counts = e - s - 1
+        interval = numpy.repeat(numpy.arange(len(s)), counts)
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        pi = s[interval] + 1 + offsets
+        # distance of points from the segment between interval ends
+        p0 = points[s[interval]]
+        v = points[e[interval]] - p0
+        d = points[pi] - p0
+        vv = (v * v).sum(axis=1)
+        t = numpy.clip(numpy.divide((d * v).sum(axis=1), vv, out=numpy.zeros(len(vv)), where=vv > 0), 0, 1)
+        d -= v * t[:, numpy.newaxis]
+        dist = (d * d).sum(axis=1)
+
+        order = numpy.lexsort((-dist, interval))
+        firstofinterval = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        furthest = order[firstofinterval]
+        split = dist[furthest] > tolerance * tolerance
+        mi = pi[furthest[split]]
+        keep[mi] = True
+        s, e = numpy.concatenate((s[split], mi)), numpy.concatenate((mi, e[split]))
+
+    return [outline[keep[first:first + len(outline)]] for outline, first in zip(outlines, firsts)]
+
+
+def init_worker(image_name, image_shape):
+    shm = shared_memory.SharedMemory(name=image_name)
+    _worker['shm'] = shm  # keep the buffer alive as long as the worker
+    _worker['image'] = numpy.ndarray(image_shape, dtype=numpy.float64, buffer=shm.buf)
+
+
+def slice_outlines(args):
+    """simplified outlines of the shared image parts above height z"""
+    z, r, tolerance = args
+    return simplifyOutlines(getImageOutlines(_worker['image'], r, z), tolerance)
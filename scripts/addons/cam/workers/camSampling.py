@@ -0,0 +1,65 @@
+# image sampling which can run in worker processes
+# this module doesn't import bpy or cam, so worker processes can import it standalone
+
+from multiprocessing import shared_memory
+import numpy
+
+_worker = {}
+
+
+def getSampleImageArray(xs, ys, sarray, minz):
+    """bilinear sampling of many points at once, gives the same heights as getSampleImage.
+    xs, ys are arrays of image coordinates, points outside of the image get -10"""
+    xs = numpy.asarray(xs, dtype=float)
+    ys = numpy.asarray(ys, dtype=float)
+    zs = numpy.full(xs.shape, -10.0)
+    inside = (xs >= 0) & (xs <= sarray.shape[0] - 1) & (ys >= 0) & (ys <= sarray.shape[1] - 1)
+    x = xs[inside]
+    y = ys[inside]
+    minx = numpy.floor(x)
+    maxx = minx + 1
+    miny = numpy.floor(y)
+    maxy = miny + 1
+    # on the last row/column the far neighbour has zero weight, clamp it to stay in the array.
+    ix0 = minx.astype(int)
+    iy0 = miny.astype(int)
+    ix1 = numpy.minimum(ix0 + 1, sarray.shape[0] - 1)
+    iy1 = numpy.minimum(iy0 + 1, sarray.shape[1] - 1)
+    s1a = sarray[ix0, iy0]
+    s2a = sarray[ix1, iy0]
+    s1b = sarray[ix0, iy1]
+    s2b = sarray[ix1, iy1]
+
+    sa = s1a * (maxx - x) + s2a * (x - minx)
+    sb = s1b * (maxx - x) + s2b * (x - minx)
+    zs[inside] = sa * (maxy - y) + sb * (y - miny)
+    return zs
+
+
+def getSamplePoints(points, sarray, minx, miny, pixsize, coordoffset, minz):
+    """samples world coordinates points of shape (n, 2 or 3) from an operation image"""
+    xs = (points[:, 0] - minx) / pixsize + coordoffset
+    ys = (points[:, 1] - miny) / pixsize + coordoffset
+    return getSampleImageArray(xs, ys, sarray, minz)
+
+
+def attach(name, shape):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker.setdefault('shm', []).append(shm)  # keep the buffer alive as long as the worker
+    return numpy.ndarray(shape, dtype=numpy.float64, buffer=shm.buf)
+
+
+def init_worker(image_name, image_shape, points_name, samples_name, npoints, minx, miny, pixsize, coordoffset,
+                minz):
+    _worker['image'] = attach(image_name, image_shape)
+    _worker['points'] = attach(points_name, (npoints, 3))
+    _worker['samples'] = attach(samples_name, (npoints,))
+    _worker['params'] = (minx, miny, pixsize, coordoffset, minz)
+
+
+def sample_tile(tile):
+    """samples points[start:end] into the shared samples array"""
+    start, end = tile
+    _worker['samples'][start:end] = getSamplePoints(_worker['points'][start:end], _worker['image'],
+                                                    *_worker['params'])
+    return end - start
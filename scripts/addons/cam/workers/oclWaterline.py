@@ -0,0 +1,51 @@
+# waterline layers computed by OpenCAMLib in worker processes
+# this module doesn't import bpy or cam, so worker processes can import it standalone
+
+try:
+    import ocl
+except ImportError:
+    try:
+        import opencamlib as ocl
+    except ImportError:
+        pass
+from multiprocessing import shared_memory
+import numpy
+
+_worker = {}
+
+
+def get_STLSurf(triangles):
+    """STLSurf from an array of triangles of shape (n, 3, 3), already in OCL units"""
+    oclSTL = ocl.STLSurf()
+    for a, b, c in triangles.tolist():
+        oclSTL.addTriangle(ocl.Triangle(ocl.Point(*a), ocl.Point(*b), ocl.Point(*c)))
+    return oclSTL
+
+
+def get_waterline(oclSTL, cutter, sampling):
+    """cutter is a tuple of ocl cutter class name and its arguments"""
+    waterline = ocl.Waterline()
+    waterline.setSTL(oclSTL)
+    waterline.setCutter(getattr(ocl, cutter[0])(*cutter[1]))
+    waterline.setSampling(sampling)
+    return waterline
+
+
+def waterline_loops(waterline, height):
+    """loops of one waterline layer as lists of points, in OCL units"""
+    waterline.reset()
+    waterline.setZ(height)
+    waterline.run2()
+    return [[(p.x, p.y, p.z) for p in l] for l in waterline.getLoops()]
+
+
+def init_worker(shm_name, shape, cutter, sampling):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    triangles = numpy.ndarray(shape, dtype=numpy.float64, buffer=shm.buf)
+    _worker['waterline'] = get_waterline(get_STLSurf(triangles), cutter, sampling)
+    del triangles
+    shm.close()
+
+
+def worker_loops(height):
+    return waterline_loops(_worker['waterline'], height)